@@ -0,0 +1,127 @@
+"""Load test for FlumeHandler/FlumeAgent against local stub Flume servers.
+
+    python -m benchmarks.bench --threads 16 --records 20000 --hosts 3 --latency 0.002 --output bench_output.txt
+
+Prints one JSON document per run, so results can be appended to a file and
+compared over time.
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import threading
+import time
+from flumehandler import FlumeAgent, FlumeHandler
+from .stub_server import serve
+
+
+def _percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _total(snapshot, name):
+    return sum(value for series, value in snapshot.items() if series.split('{')[0] == name)
+
+
+def run(args):
+    # every stub listens on its own loopback address, so the agent sees distinct hosts on one port
+    hosts = ['127.0.0.%d' % (i + 1) for i in range(args.hosts)]
+    stubs = []
+    for host in hosts:
+        stub, server = serve(args.port, host=host, latency=args.latency, failure_rate=args.failure_rate,
+                             slow_ack_rate=args.slow_ack_rate, slow_ack_delay=args.slow_ack_delay,
+                             failed_status_rate=args.failed_status_rate)
+        stubs.append(stub)
+    agent = FlumeAgent(hosts, args.port, batch_size=args.batch_size, max_size=args.max_size, thread_size=args.thread_size,
+                       per_thread_buffers=args.per_thread_buffers)
+    agent.start()
+
+    handler = FlumeHandler(agent, pre_encode=args.pre_encode, type='bench')
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    logger = logging.getLogger('flumehandler.bench')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    latencies = [[] for i in range(args.threads)]
+    payload = 'x' * args.body_size
+
+    def work(n):
+        samples = latencies[n]
+        for i in range(args.records):
+            start = time.perf_counter()
+            logger.info('GET /bench/%(thread)s/%(seq)s %(payload)s', {'thread': n, 'seq': i, 'payload': payload})
+            samples.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(args.threads)]
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    emit_seconds = time.perf_counter() - start
+    handler.flush()
+    total = args.threads * args.records
+    deadline = time.time() + args.drain_timeout
+    while time.time() < deadline:
+        # every record is either delivered or counted as dropped
+        if sum(stub.events for stub in stubs) + _total(agent.metrics.snapshot(), 'flume_events_dropped_total') >= total:
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    agent.running = False
+
+    snapshot = agent.metrics.snapshot()
+    delivered = sum(stub.events for stub in stubs)
+    samples = [sample for thread_samples in latencies for sample in thread_samples]
+    return {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'config': vars(args),
+        'records': total,
+        'delivered': delivered,
+        'dropped': _total(snapshot, 'flume_events_dropped_total'),
+        'emit_events_per_second': total / emit_seconds,
+        'delivered_events_per_second': delivered / elapsed,
+        'emit_p50_us': _percentile(samples, 0.5) * 1e6,
+        'emit_p99_us': _percentile(samples, 0.99) * 1e6,
+        'cpu_us_per_event': cpu / total * 1e6,
+        'send_failures': _total(snapshot, 'flume_send_failures_total'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8, help='application threads logging concurrently')
+    parser.add_argument('--records', type=int, default=10000, help='records logged per thread')
+    parser.add_argument('--body-size', type=int, default=200, help='padding added to every record, in characters')
+    parser.add_argument('--hosts', type=int, default=1, help='stub flume servers to start, on 127.0.0.1, 127.0.0.2, ...')
+    parser.add_argument('--port', type=int, default=41414, help='port of the stub servers')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every appendBatch')
+    parser.add_argument('--failure-rate', type=float, default=0, help='fraction of appendBatch calls that fail')
+    parser.add_argument('--slow-ack-rate', type=float, default=0, help='fraction of appendBatch calls acked late')
+    parser.add_argument('--slow-ack-delay', type=float, default=0.5, help='seconds a slow ack is delayed')
+    parser.add_argument('--failed-status-rate', type=float, default=0, help='fraction of appendBatch calls answered FAILED')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--max-size', type=int, default=10000)
+    parser.add_argument('--thread-size', type=int, default=3)
+    parser.add_argument('--pre-encode', action='store_true')
+    parser.add_argument('--per-thread-buffers', action='store_true')
+    parser.add_argument('--drain-timeout', type=float, default=30, help='seconds to wait for queued events after logging')
+    parser.add_argument('--output', help='append the JSON result to this file')
+    args = parser.parse_args(argv)
+    result = json.dumps(run(args), sort_keys=True)
+    print(result)
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(result + '\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
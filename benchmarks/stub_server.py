@@ -0,0 +1,52 @@
+import random
+import threading
+import time
+from thrift.transport.TSocket import TServerSocket
+from thrift.transport.TTransport import TFramedTransportFactory
+from thrift.protocol.TCompactProtocol import TCompactProtocolFactory
+from thrift.server.TServer import TThreadedServer
+from flumehandler.thrift_protocol import Iface, Processor
+from flumehandler.thrift_ttypes import Status
+
+
+class StubFlume(Iface):
+    """Stand-in for a Flume ThriftSource with injectable latency, failures and slow acks."""
+
+    def __init__(self, latency=0, failure_rate=0, slow_ack_rate=0, slow_ack_delay=0, failed_status_rate=0):
+        self.latency = latency  # seconds added to every call
+        self.failure_rate = failure_rate  # fraction of calls answered with an exception
+        self.slow_ack_rate = slow_ack_rate  # fraction of calls delayed by slow_ack_delay
+        self.slow_ack_delay = slow_ack_delay  # seconds
+        self.failed_status_rate = failed_status_rate  # fraction of calls answered with Status.FAILED
+        self.events = 0
+        self.batches = 0
+        self.lock = threading.Lock()
+
+    def append(self, event):
+        return self.appendBatch([event])
+
+    def appendBatch(self, events):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.slow_ack_rate and random.random() < self.slow_ack_rate:
+            time.sleep(self.slow_ack_delay)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise Exception('injected failure')
+        if self.failed_status_rate and random.random() < self.failed_status_rate:
+            return Status.FAILED
+        with self.lock:
+            self.events += len(events)
+            self.batches += 1
+        return Status.OK
+
+
+def serve(port, host='127.0.0.1', **kwargs):
+    """Start a StubFlume on ``port`` in a daemon thread, returning the handler and the server."""
+    handler = StubFlume(**kwargs)
+    server = TThreadedServer(Processor(handler), TServerSocket(host=host, port=port),
+                             TFramedTransportFactory(), TCompactProtocolFactory(), daemon=True)
+    server.serverTransport.listen()
+    server.serverTransport.listen = lambda: None  # already listening once serve() runs
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    return handler, server
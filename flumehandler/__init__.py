@@ -1,4 +1,12 @@
 from .flume_agent import FlumeAgent
 from .flume_handler import FlumeHandler
+from .async_flume_agent import AsyncFlumeAgent
+from .async_flume_handler import AsyncFlumeHandler
+from .shared_memory_agent import SharedMemoryAgent
+from .transports import ThriftTransport, ScatterGatherTransport, AvroTransport
+from .refreshed import Refreshed
+from .metrics import MetricsRegistry, serve_prometheus
 
-__all__ = ['FlumeAgent', 'FlumeHandler']
+__all__ = ['FlumeAgent', 'FlumeHandler', 'AsyncFlumeAgent', 'AsyncFlumeHandler', 'SharedMemoryAgent',
+           'ThriftTransport', 'ScatterGatherTransport', 'AvroTransport', 'Refreshed',
+           'MetricsRegistry', 'serve_prometheus']
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import struct
+import time
+from thrift.Thrift import TMessageType, TApplicationException
+from thrift.transport.TTransport import TMemoryBuffer
+from thrift.protocol.TCompactProtocol import TCompactProtocol
+from .thrift_protocol import appendBatch_result
+from .thrift_encoder import encode_batch
+
+
+class _AsyncClient:
+
+    def __init__(self, host, reader, writer):
+        self.host = host
+        self.reader = reader
+        self.writer = writer
+
+    async def appendBatch(self, events):
+        message = encode_batch(events)
+        self.writer.write(struct.pack('!i', len(message)) + message)
+        await self.writer.drain()
+        size, = struct.unpack('!i', await self.reader.readexactly(4))
+        iprot = TCompactProtocol(TMemoryBuffer(await self.reader.readexactly(size)))
+        (fname, mtype, rseqid) = iprot.readMessageBegin()
+        if mtype == TMessageType.EXCEPTION:
+            x = TApplicationException()
+            x.read(iprot)
+            iprot.readMessageEnd()
+            raise x
+        result = appendBatch_result()
+        result.read(iprot)
+        iprot.readMessageEnd()
+        if result.success is not None:
+            return result.success
+        raise TApplicationException(TApplicationException.MISSING_RESULT, "appendBatch failed: unknown result")
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncFlumeAgent:
+    """FlumeAgent counterpart running on an asyncio event loop instead of threads.
+
+    ``put`` never blocks: events are batched in memory, a batch is cut when it
+    reaches ``batch_size`` or ``linger`` seconds after its first event, and
+    one sender task per host drains the queue, so all hosts are sent to
+    concurrently. A batch that fails is put back for the next sender. Events
+    should be pre-encoded (see ``thrift_encoder``).
+    """
+
+    def __init__(self, hosts, port, batch_size=50, max_size=10000, linger=1.0, connect_timeout=3,
+                 shutdown_timeout=10):
+        self.hosts = hosts
+        self.port = port
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.linger = linger  # seconds
+        self.connect_timeout = connect_timeout  # seconds
+        self.shutdown_timeout = shutdown_timeout  # seconds stop() drains for when none is given
+        self.send_queue = None
+        self.events = []
+        self.last_exception_time = 0
+        self.exception_interval = 1  # seconds
+        self.recover_interval = 5  # seconds
+        self.loop = None
+        self.running = False
+        self._flush_handle = None
+        self._tasks = []
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.send_queue = asyncio.Queue(self.max_size)
+        self.running = True
+        self._tasks = [self.loop.create_task(self._send_runnable(host)) for host in self.hosts]
+
+    async def stop(self, timeout=None):
+        """Drain the send queue for up to ``timeout`` seconds (``shutdown_timeout`` by default).
+
+        Returns the number of events left unsent, which are discarded.
+        """
+        self.flush()
+        self.running = False
+        unsent = 0
+        if self.send_queue is not None:
+            try:
+                await asyncio.wait_for(self.send_queue.join(), self.shutdown_timeout if timeout is None else timeout)
+            except asyncio.TimeoutError:
+                while not self.send_queue.empty():
+                    unsent += len(self.send_queue.get_nowait())
+                logging.error('Timeout when stopping: %d events left unsent', unsent)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        return unsent
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self.events:
+            events = self.events
+            self.events = []
+            self._enqueue(events)
+
+    def put(self, event, priority=None):
+        self.events.append(event)  # one lane, batches are cut by the event loop
+        if len(self.events) >= self.batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.linger, self.flush)
+
+    def _enqueue(self, events):
+        try:
+            self.send_queue.put_nowait(events)
+        except asyncio.QueueFull as e:
+            self._log_exception('The send queue is oversize the max size: %d', self.max_size, exc_info=e)
+
+    def _log_exception(self, msg, *args, exc_info=None):
+        now = time.time()
+        if now - self.last_exception_time > self.exception_interval:
+            self.last_exception_time = now
+            logging.exception(msg, *args, exc_info=exc_info)
+
+    async def _send_runnable(self, host):
+        client = None
+        # once stopped, keep sending until the queue is drained and stop() cancels the task
+        while self.running or not self.send_queue.empty():
+            if client is None:
+                try:
+                    client = await self._connect(host, self.port)
+                except Exception as e:
+                    logging.exception('Error when connecting to flume, host is %s', host, exc_info=e)
+                    await asyncio.sleep(self.recover_interval)
+                    continue
+            events = await self.send_queue.get()
+            try:
+                await client.appendBatch(events)
+            except Exception as e:
+                logging.exception('Error when sending events to flume, host is %s', host, exc_info=e)
+                client.close()
+                client = None
+                self._enqueue(events)  # to the next sender, possibly through another host
+            finally:
+                self.send_queue.task_done()
+
+    async def _connect(self, host, port):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.connect_timeout)
+        return _AsyncClient(host, reader, writer)
@@ -0,0 +1,38 @@
+import asyncio
+from .flume_handler import FlumeHandler
+from .async_flume_agent import AsyncFlumeAgent
+
+
+class AsyncFlumeHandler(FlumeHandler):
+    """FlumeHandler for an AsyncFlumeAgent, safe to call from any thread without blocking the loop."""
+
+    def __init__(self, flume_agent: AsyncFlumeAgent, **kwargs):
+        super().__init__(flume_agent, pre_encode=True, **kwargs)
+        self.lazy_format = False  # the agent has no sender threads to format on
+
+    def _ship(self, record):
+        event = self.convert(record)
+        self._call_in_loop(self.flume_agent.put, event)
+
+    def flush(self):
+        self._flush_summaries()
+        self._call_in_loop(self.flume_agent.flush)
+
+    def close(self):
+        super(FlumeHandler, self).close()
+        loop = self.flume_agent.loop
+        if loop is not None and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self.flume_agent.stop(), loop)
+
+    def _call_in_loop(self, func, *args):
+        loop = self.flume_agent.loop
+        if loop is None or loop.is_closed():
+            return  # agent not started or already gone
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            func(*args)
+        else:
+            loop.call_soon_threadsafe(func, *args)
@@ -0,0 +1,172 @@
+import hashlib
+import socket
+import struct
+import zlib
+from .thrift_ttypes import Status
+from .thrift_encoder import to_event
+
+# Avro RPC client for Flume's AvroSource, speaking the Netty transceiver framing.
+
+PROTOCOL = (
+    '{"protocol":"AvroSourceProtocol","namespace":"org.apache.flume.source.avro",'
+    '"types":[{"type":"enum","name":"Status","symbols":["OK","FAILED","UNKNOWN"]},'
+    '{"type":"record","name":"AvroFlumeEvent","fields":[{"name":"headers","type":{"type":"map","values":"string"}},'
+    '{"name":"body","type":"bytes"}]}],'
+    '"messages":{"append":{"request":[{"name":"event","type":"AvroFlumeEvent"}],"response":"Status"},'
+    '"appendBatch":{"request":[{"name":"events","type":{"type":"array","items":"AvroFlumeEvent"}}],"response":"Status"}}}'
+)
+PROTOCOL_HASH = hashlib.md5(PROTOCOL.encode('utf8')).digest()
+
+_AVRO_STATUS = [Status.OK, Status.FAILED, Status.UNKNOWN]  # symbols of the Avro Status enum, in order
+_HANDSHAKE_NONE = 2
+_INT = struct.Struct('!i')
+
+
+class AvroRemoteException(Exception):
+    pass
+
+
+def _long(n):
+    n = (n << 1) ^ (n >> 63)
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _bytes(value):
+    if isinstance(value, str):
+        value = value.encode('utf8')
+    return _long(len(value)) + value
+
+
+def _encode_events(events):
+    parts = [_long(len(events))] if events else []
+    for event in map(to_event, events):
+        headers = event.headers or {}
+        if headers:
+            parts.append(_long(len(headers)))
+            for k, v in headers.items():
+                parts.append(_bytes(k))
+                parts.append(_bytes(v))
+        parts.append(b'\x00')
+        parts.append(_bytes(event.body or b''))
+    parts.append(b'\x00')
+    return b''.join(parts)
+
+
+class _Decoder:
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read_long(self):
+        n = shift = 0
+        while True:
+            b = self.data[self.pos]
+            self.pos += 1
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                return (n >> 1) ^ -(n & 1)
+            shift += 7
+
+    def read_bytes(self):
+        size = self.read_long()
+        self.pos += size
+        return self.data[self.pos - size:self.pos]
+
+    def read_fixed(self, size):
+        self.pos += size
+        return self.data[self.pos - size:self.pos]
+
+    def skip_map(self):
+        while True:
+            count = self.read_long()
+            if count == 0:
+                return
+            if count < 0:
+                count = -count
+                self.read_long()  # block size
+            for i in range(count):
+                self.read_bytes()
+                self.read_bytes()
+
+
+class AvroClient:
+
+    def __init__(self, sock, compression_level=None):
+        self.sock = sock
+        self.serial = 0
+        self.handshaked = False
+        # deflate applies to the whole stream, as with Flume's "compression-type = deflate"
+        self.compressor = zlib.compressobj(compression_level) if compression_level is not None else None
+        self.decompressor = zlib.decompressobj() if compression_level is not None else None
+        self.rbuf = b''
+
+    def appendBatch(self, events):
+        message = b''
+        if not self.handshaked:
+            message += PROTOCOL_HASH + b'\x02' + _bytes(PROTOCOL) + PROTOCOL_HASH + b'\x00'
+        message += b'\x00' + _bytes('appendBatch') + _encode_events(events)
+        self.serial += 1
+        self._write(_INT.pack(self.serial) + _INT.pack(1) + _INT.pack(len(message)) + message)
+        return self._read_response(self._read_frame())
+
+    def appendBatches(self, batches):
+        return [self.appendBatch(events) for events in batches]
+
+    def close(self):
+        self.sock.close()
+
+    def _read_response(self, data):
+        decoder = _Decoder(data)
+        if not self.handshaked:
+            match = decoder.read_long()
+            if decoder.read_long():
+                decoder.read_bytes()  # server protocol
+            if decoder.read_long():
+                decoder.read_fixed(16)  # server hash
+            if decoder.read_long():
+                decoder.skip_map()
+            if match == _HANDSHAKE_NONE:
+                raise AvroRemoteException('Avro handshake rejected by the server')
+            self.handshaked = True
+        decoder.skip_map()  # response metadata
+        if decoder.read_fixed(1) != b'\x00':
+            decoder.read_long()  # error union branch
+            raise AvroRemoteException(decoder.read_bytes().decode('utf8', 'replace'))
+        return _AVRO_STATUS[decoder.read_long()]
+
+    def _write(self, data):
+        if self.compressor is not None:
+            data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.sock.sendall(data)
+
+    def _read_frame(self):
+        serial, count = struct.unpack('!ii', self._read(8))
+        buffers = []
+        for i in range(count):
+            size, = _INT.unpack(self._read(4))
+            buffers.append(self._read(size))
+        return b''.join(buffers)
+
+    def _read(self, size):
+        while len(self.rbuf) < size:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise EOFError('Connection closed by the server')
+            if self.decompressor is not None:
+                chunk = self.decompressor.decompress(chunk)
+            self.rbuf += chunk
+        data, self.rbuf = self.rbuf[:size], self.rbuf[size:]
+        return data
+
+
+def connect(host, port, compression_level=None, timeout=None, connect_timeout=None):
+    sock = socket.create_connection((host, port), timeout if connect_timeout is None else connect_timeout)
+    sock.settimeout(timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return AvroClient(sock, compression_level)
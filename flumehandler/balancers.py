@@ -0,0 +1,75 @@
+import math
+import random
+import time
+
+
+class HostStats:
+    """Sends in flight and peak-EWMA of appendBatch round trip times for one host."""
+
+    def __init__(self, decay=10):
+        self.decay = decay  # seconds
+        self.outstanding = 0
+        self.ewma = 0.0
+        self.last_update = time.time()
+
+    def observe(self, rtt):
+        now = time.time()
+        w = math.exp(-(now - self.last_update) / self.decay)
+        if rtt > self.ewma * w:
+            self.ewma = rtt  # peak: react to a slow host at once, recover slowly
+        else:
+            self.ewma = self.ewma * w + rtt * (1 - w)
+        self.last_update = now
+
+    def cost(self):
+        # decayed by the time since the last observation, so a host left alone after a slow batch is tried again
+        w = math.exp(-(time.time() - self.last_update) / self.decay)
+        return self.ewma * w * (self.outstanding + 1)
+
+
+class RoundRobin:
+
+    def choose(self, idle, stats):
+        return idle[0]  # released connections go to the back, so this rotates over hosts
+
+
+class LeastOutstanding:
+    """Prefers the host with the fewest of its connections lent out.
+
+    Only idle connections are candidates, so with ``connections_per_host=1``
+    every candidate host has none lent out and this rotates like RoundRobin.
+    """
+
+    def choose(self, idle, stats):
+        return min(idle, key=lambda connection: stats[connection.host].outstanding)
+
+
+class PeakEwma:
+
+    def choose(self, idle, stats):
+        return min(idle, key=lambda connection: stats[connection.host].cost())
+
+
+class PowerOfTwoChoices:
+    """Compares the peak-EWMA cost of two random idle connections."""
+
+    def choose(self, idle, stats):
+        if len(idle) == 1:
+            return idle[0]
+        a, b = random.sample(range(len(idle)), 2)
+        a, b = idle[a], idle[b]
+        return a if stats[a.host].cost() <= stats[b.host].cost() else b
+
+
+BALANCERS = {
+    'round_robin': RoundRobin,
+    'least_outstanding': LeastOutstanding,
+    'peak_ewma': PeakEwma,
+    'p2c': PowerOfTwoChoices,
+}
+
+
+def get_balancer(balancer):
+    if isinstance(balancer, str):
+        return BALANCERS[balancer]()
+    return balancer
@@ -0,0 +1,17 @@
+import time
+
+HIGH = 0  # lane of WARNING and above, sent first and kept when the queue is near full
+NORMAL = 1
+
+
+class Batch(list):
+    """List of events sent in one appendBatch call, with its delivery attempts."""
+
+    __slots__ = ('created', 'attempts', 'priority', 'partition')
+
+    def __init__(self, events=(), priority=NORMAL, partition=None):
+        super().__init__(events)
+        self.created = time.time()
+        self.attempts = 0
+        self.priority = priority
+        self.partition = partition  # routing key of every event of the batch
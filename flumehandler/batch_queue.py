@@ -0,0 +1,125 @@
+import random
+import threading
+from collections import deque
+from queue import Empty
+from .batch import HIGH, NORMAL
+from .thrift_encoder import event_size
+
+POLICIES = ('drop_newest', 'drop_oldest', 'block', 'sample')
+
+
+class BatchQueue:
+    """Bounded queue of batches with a HIGH and a NORMAL lane and a policy for when it is full.
+
+    HIGH batches are taken first, and NORMAL batches may only fill the
+    queue up to ``maxsize`` minus a ``high_reserve`` fraction kept for HIGH.
+    When there is no room, ``policy`` decides: ``drop_newest`` discards the
+    incoming batch, ``drop_oldest`` evicts the oldest batch of the lowest
+    lane, ``block`` waits up to ``block_timeout`` seconds before discarding
+    the incoming batch and ``sample`` additionally keeps a decreasing share
+    of the events of NORMAL batches once the queue is ``sample_threshold``
+    full.
+
+    With ``max_bytes`` the summed ``event_size`` of the queued events is
+    bounded as well, with the same share reserved for HIGH.
+    """
+
+    def __init__(self, maxsize, policy='drop_newest', block_timeout=1, high_reserve=0.1, sample_threshold=0.8,
+                 max_bytes=None):
+        if policy not in POLICIES:
+            raise ValueError('unknown backpressure policy: %s' % policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.reserve = int(maxsize * high_reserve)
+        self.sample_threshold = sample_threshold
+        self.max_bytes = max_bytes
+        self.bytes_reserve = int(max_bytes * high_reserve) if max_bytes else 0
+        self.bytes = 0
+        self.lanes = (deque(), deque())  # indexed by priority, of (batch, size)
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+    def after_fork(self):
+        """Forget the batches and locks inherited from the parent process."""
+        self.lanes = (deque(), deque())
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+    def qsize(self):
+        return len(self.lanes[HIGH]) + len(self.lanes[NORMAL])
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def put(self, batch, timeout=None):
+        """Enqueue ``batch``, returning the ``(batch, reason)`` pairs discarded on the way, possibly ``batch`` itself."""
+        priority = getattr(batch, 'priority', NORMAL)
+        size = sum(map(event_size, batch)) if self.max_bytes else 0
+        discarded = []
+        with self.lock:
+            if timeout is None and self.policy == 'block':
+                timeout = self.block_timeout
+            if timeout and not self._has_room(priority, size):
+                self.not_full.wait_for(lambda: self._has_room(priority, size), timeout)
+            if self.policy == 'sample' and priority == NORMAL:
+                pressure = self.qsize() / max(1, self.maxsize - self.reserve)
+                if self.max_bytes:
+                    pressure = max(pressure, self.bytes / max(1, self.max_bytes - self.bytes_reserve))
+                if pressure > self.sample_threshold:
+                    keep = max(0.0, (1 - pressure) / (1 - self.sample_threshold))
+                    kept, dropped = [], []
+                    for event in batch:
+                        (kept if random.random() < keep else dropped).append(event)
+                    if dropped:
+                        batch[:] = kept
+                        discarded.append((dropped, 'sampled'))
+                        if self.max_bytes:
+                            size = sum(map(event_size, batch))
+                    if not batch:
+                        return discarded
+            if self.policy == 'drop_oldest':
+                # a large batch may need several smaller ones evicted
+                while not self._has_room(priority, size) and self._fits(priority, size):
+                    lane = self.lanes[NORMAL] or (self.lanes[HIGH] if priority == HIGH else None)
+                    if not lane:
+                        break
+                    evicted, evicted_size = lane.popleft()
+                    self.bytes -= evicted_size
+                    discarded.append((evicted, 'queue_full'))
+            if not self._has_room(priority, size):
+                discarded.append((batch, 'queue_full'))
+                return discarded
+            self.lanes[priority].append((batch, size))
+            self.bytes += size
+            self.not_empty.notify()
+        return discarded
+
+    def get(self, block=True, timeout=None):
+        with self.lock:
+            if not self.qsize():
+                if not block or not self.not_empty.wait_for(self.qsize, timeout):
+                    raise Empty
+            batch, size = (self.lanes[HIGH] or self.lanes[NORMAL]).popleft()
+            self.bytes -= size
+            self.not_full.notify_all()  # waiting batches of different sizes may fit now
+            return batch
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def _has_room(self, priority, size=0):
+        limit = self.maxsize if priority == HIGH else self.maxsize - self.reserve
+        if self.qsize() >= limit:
+            return False
+        return not self.max_bytes or self.bytes + size <= self._bytes_limit(priority)
+
+    def _fits(self, priority, size):
+        # whether the batch fits in the queue at all, else there is no point in evicting
+        return not self.max_bytes or size <= self._bytes_limit(priority)
+
+    def _bytes_limit(self, priority):
+        return self.max_bytes if priority == HIGH else self.max_bytes - self.bytes_reserve
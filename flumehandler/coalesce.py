@@ -0,0 +1,78 @@
+import logging
+import threading
+import time
+
+
+def _fingerprint(exc_info):
+    # type and code locations of an exception, not its message, which often carries ids
+    if not exc_info or exc_info[0] is None:
+        return None
+    frames = []
+    tb = exc_info[2]
+    while tb is not None:
+        frames.append((tb.tb_frame.f_code.co_filename, tb.tb_lineno))
+        tb = tb.tb_next
+    return exc_info[0].__qualname__, tuple(frames)
+
+
+class RecordCoalescer:
+    """Suppresses repeats of a record within ``window`` seconds of its first occurrence and summarizes them.
+
+    Records are repeats when they share logger, level, message template and
+    exception fingerprint. When the window of a record has passed, one
+    summary record reports how many repeats were suppressed, with the times
+    of the first and the last one.
+
+    Thread-safe; its lock is only held for the bookkeeping of one record.
+    """
+
+    def __init__(self, window):
+        self.window = window  # seconds
+        self.seen = dict()  # key -> [first occurrence, window end, repeats, last repeat time]
+        self.pending = []  # windows that ended when their record came again
+        self.next_sweep = 0
+        self.lock = threading.Lock()
+
+    def check(self, record):
+        """Return True when ``record`` should be shipped, False when it is a repeat."""
+        key = (record.name, record.levelno, record.msg, _fingerprint(record.exc_info))
+        try:
+            hash(key)
+        except TypeError:
+            return True  # unhashable message template
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is None or record.created >= entry[1]:
+                if entry is not None and entry[2]:
+                    self.pending.append(entry)  # reported by the next due_summaries
+                # only what the summary needs: the record itself would keep a traceback's frames alive
+                first = (record.name, record.levelno, record.pathname, record.lineno, record.msg, record.created)
+                self.seen[key] = [first, record.created + self.window, 0, None]
+                return True
+            entry[2] += 1
+            entry[3] = record.created
+            return False
+
+    def due_summaries(self, force=False):
+        """Return summary records for the windows that have passed, or for every window with ``force``."""
+        now = time.time()
+        if not force and now < self.next_sweep and not self.pending:
+            return []
+        with self.lock:
+            self.next_sweep = now + min(self.window, 1)
+            entries, self.pending = self.pending, []
+            for key, entry in list(self.seen.items()):
+                if force or now >= entry[1]:
+                    del self.seen[key]
+                    if entry[2]:
+                        entries.append(entry)
+        return [self._summary(*entry) for entry in entries]
+
+    def _summary(self, first, end, repeats, last):
+        name, levelno, pathname, lineno, msg, created = first
+        args = {'repeats': repeats, 'template': str(msg),
+                'first': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created)),
+                'last': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last))}
+        return logging.LogRecord(
+            name, levelno, pathname, lineno,
+            'repeated %(repeats)d more times between %(first)s and %(last)s: %(template)s', (args,), None)
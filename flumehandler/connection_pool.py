@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import deque
+from .balancers import HostStats, RoundRobin
+
+
+class Connection:
+
+    def __init__(self, host, client):
+        self.host = host
+        self.client = client
+
+
+class ConnectionPool:
+    """Open connections to the flume hosts, each lent to one sender at a time."""
+
+    def __init__(self, balancer=None, ring=None):
+        self.balancer = balancer or RoundRobin()
+        self.ring = ring  # HashRing routing keyed acquires to one host
+        self.connections = dict()  # host -> [Connection]
+        self.stats = dict()  # host -> HostStats
+        self.idle = deque()
+        self.cooling = dict()  # host -> time until which its connections are not lent
+        self.waiting = dict()  # host -> keyed acquires waiting for one of its connections
+        self.cond = threading.Condition()
+
+    def add(self, host, client):
+        with self.cond:
+            connection = Connection(host, client)
+            if host not in self.connections:
+                # a reconnected host starts over, connections discarded while lent out are still released
+                stats = self.stats.get(host)
+                self.stats[host] = HostStats()
+                self.stats[host].outstanding = stats.outstanding if stats else 0
+            self.connections.setdefault(host, []).append(connection)
+            self.idle.append(connection)
+            self.cond.notify_all()
+
+    def acquire(self, timeout=None, key=None) -> Connection:
+        """Take an idle connection of a host that is not cooling down for exclusive use.
+
+        With a ``key`` and a ``ring``, only connections of the host the ring
+        chooses for the key are taken. Returns None if there is none within
+        ``timeout``.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while True:
+                available = self._available()
+                host = None
+                if key is not None and self.ring is not None:
+                    # sends in flight and waiting, so a hot key overflows to the next host on the ring
+                    loads = {host: self.stats[host].outstanding + self.waiting.get(host, 0)
+                             for host in self.connections if host not in self.cooling}
+                    capacities = {host: len(self.connections[host]) for host in loads}
+                    host = self.ring.choose(key, loads, capacities)
+                    available = [connection for connection in available if connection.host == host]
+                if available:
+                    break
+                now = time.time()
+                wait = None if deadline is None else deadline - now
+                cooling = [self.cooling[connection.host] for connection in self.idle if connection.host in self.cooling]
+                if cooling:
+                    # wake up when the first idle host is lent again
+                    until = max(0.001, min(cooling) - now)
+                    wait = until if wait is None or wait > until else wait
+                if wait is not None and wait <= 0:
+                    return None
+                if host is None:
+                    self.cond.wait(wait)
+                    continue
+                self.waiting[host] = self.waiting.get(host, 0) + 1
+                try:
+                    self.cond.wait(wait)
+                finally:
+                    self.waiting[host] -= 1
+            connection = self.balancer.choose(available, self.stats)
+            self.idle.remove(connection)
+            self.stats[connection.host].outstanding += 1
+            return connection
+
+    def cool_down(self, host, seconds):
+        """Lend no connection of ``host`` for ``seconds``, its connections stay open."""
+        with self.cond:
+            self.cooling[host] = time.time() + seconds
+
+    def _available(self):
+        if not self.cooling:
+            return self.idle
+        now = time.time()
+        for host in [host for host, until in self.cooling.items() if until <= now]:
+            del self.cooling[host]
+        if not self.cooling:
+            return self.idle
+        return [connection for connection in self.idle if connection.host not in self.cooling]
+
+    def observe(self, connection, rtt):
+        with self.cond:
+            self.stats[connection.host].observe(rtt)
+
+    def release(self, connection):
+        with self.cond:
+            self.stats[connection.host].outstanding -= 1
+            if connection in self.connections.get(connection.host, ()):
+                self.idle.append(connection)
+                self.cond.notify_all()  # keyed acquires wait for particular hosts
+
+    def discard(self, connection):
+        with self.cond:
+            connections = self.connections.get(connection.host, [])
+            if connection in connections:
+                connections.remove(connection)
+            if not connections:
+                self.connections.pop(connection.host, None)
+            if connection in self.idle:
+                self.idle.remove(connection)
+        try:
+            connection.client.close()
+        except Exception:
+            pass
+
+    def count(self, host):
+        with self.cond:
+            return len(self.connections.get(host, ()))
@@ -0,0 +1,28 @@
+class DeferredEvent:
+    """Snapshot of a record taken at emit time, formatted into an event by the thread that ships it."""
+
+    __slots__ = ('render_func', 'record', 'headers', 'size')
+
+    def __init__(self, render_func, record, headers, size):
+        self.render_func = render_func  # (record, headers) -> event, or None if the record cannot be rendered
+        self.record = record
+        self.headers = headers  # dynamic headers, evaluated at emit time
+        self.size = size  # estimated payload size, for max_batch_bytes
+
+    def render(self):
+        return self.render_func(self.record, self.headers)
+
+
+def render_batch(events):
+    """Replace deferred events of ``events`` in place by their rendered events, dropping those that fail."""
+    if not any(type(event) is DeferredEvent for event in events):
+        return events
+    rendered = []
+    for event in events:
+        if type(event) is DeferredEvent:
+            event = event.render()
+            if event is None:
+                continue
+        rendered.append(event)
+    events[:] = rendered
+    return events
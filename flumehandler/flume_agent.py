@@ -1,148 +1,666 @@
+import atexit
+import os
 import threading
 import logging
+import weakref
 import time
-from queue import Queue, Empty, Full
-from thrift.transport.TSocket import TSocket
-from thrift.transport.TTransport import TFramedTransport
-from thrift.protocol.TCompactProtocol import TCompactProtocol
-from .thrift_protocol import Client
+import heapq
+import random
+from queue import Empty
+from .flume_client import FlumeClient
+from .connection_pool import ConnectionPool, Connection
+from .balancers import get_balancer
+from .transports import ThriftTransport
+from .staging_buffer import StagingBuffer
+from .spill_queue import SpillQueue
+from .metrics import MetricsRegistry
+from .thrift_encoder import event_size, to_bytes
+from .batch import Batch, HIGH, NORMAL
+from .thrift_ttypes import Status, ThriftFlumeEvent
+from .hash_ring import HashRing
+from .batch_queue import BatchQueue
+from .deferred import DeferredEvent, render_batch
+
+_agents = weakref.WeakSet()  # every agent, reset in forked children
+
+
+def _after_fork_in_child():
+    for agent in list(_agents):
+        agent._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
 
 
 class FlumeAgent:
 
-    def __init__(self, hosts, port, batch_size=50, max_size=10000, thread_size=3):
+    def __init__(self, hosts, port, batch_size=50, max_size=10000, thread_size=3, pipeline_window=1,
+                 max_batch_bytes=None, linger_ms=None, spill_dir=None, spill_max_bytes=1024 * 1024 * 1024,
+                 per_thread_buffers=False, transport=None, metrics=None,
+                 connections_per_host=1, balancer='round_robin',
+                 retry_attempts=0, retry_backoff=0.1, retry_max_backoff=10, retry_deadline=60,
+                 backpressure='drop_newest', block_timeout=1, high_priority_reserve=0.1, sample_threshold=0.8,
+                 shutdown_timeout=10, connect_timeout=3, recover_backoff=0.5, recover_max_backoff=30,
+                 cooldown=0.1, max_cooldown=5, max_queue_bytes=None, route_key=None, route_load_factor=1.25):
         self.hosts = hosts
         self.port = port
         self.batch_size = batch_size
         self.max_size = max_size
-        self.send_queue = Queue(max_size)
+        # drop_newest, drop_oldest, block or sample when the send queue is full, see BatchQueue
+        self.send_queue = BatchQueue(max_size, backpressure, block_timeout, high_priority_reserve, sample_threshold,
+                                     max_queue_bytes)
+        self.max_queue_bytes = max_queue_bytes  # queued events are then kept encoded, and their bytes bounded
         self.thread_size = thread_size
-        self.clients = []
-        self.client2host = dict()
-        self.bad_hosts = dict()
-        self.events = []
+        self.pipeline_window = pipeline_window  # max appendBatch calls in flight per connection
+        self.connect_timeout = connect_timeout  # seconds, for transports without a timeout of their own
+        self.transport = transport or ThriftTransport(pipeline_window, connect_timeout)
+        if getattr(self.transport, 'connect_timeout', 0) is None and getattr(self.transport, 'timeout', None) is None:
+            self.transport.connect_timeout = connect_timeout
+        self.max_batch_bytes = max_batch_bytes  # a batch is cut before it grows beyond this size
+        self.linger_ms = linger_ms  # max time a partial batch waits before it is flushed
+        self.per_thread_buffers = per_thread_buffers  # stage events per application thread, off the shared lock
+        # overflow and failed batches are spilled to disk and replayed instead of being discarded
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        # spill_max_bytes bounds spill_dir as a whole, including the pid-<pid> subdirectories of other processes
+        self.spill = self._open_spill() if spill_dir else None
+        self.adopt_time = 0  # last scan of spill_dir for segments of processes that have exited
+        self.connections_per_host = connections_per_host
+        # round_robin, least_outstanding, peak_ewma, p2c or an object with choose(idle, stats)
+        # batches are cut per value of the route_key header and sent to the host consistent hashing picks for it
+        self.route_key = route_key
+        self.pool = ConnectionPool(get_balancer(balancer), HashRing(hosts, load_factor=route_load_factor) if route_key else None)
+        self.bad_hosts = dict()  # host with less than connections_per_host connections -> time of the next attempt
+        self.host_failures = dict()  # host -> failures since its last successful send
+        self.recover_backoff = recover_backoff  # seconds before the first reconnect, doubled per failure
+        self.recover_max_backoff = recover_max_backoff  # seconds
+        self.recover_event = threading.Event()
+        # a host answering FAILED keeps its connections but lends none for a cool-down, doubled per rejection
+        self.cooldown = cooldown  # seconds
+        self.max_cooldown = max_cooldown  # seconds
+        self.host_rejections = dict()  # host -> rejected sends since its last delivered batch
+        self.retry_attempts = retry_attempts  # times a failed batch is sent again
+        self.retry_backoff = retry_backoff  # seconds, doubled per attempt, with full jitter
+        self.retry_max_backoff = retry_max_backoff  # seconds
+        self.retry_deadline = retry_deadline  # seconds after a batch was cut when it is given up
+        self.retries = []  # heap of (due time, seq, batch)
+        self.retry_seq = 0
+        self.retry_lock = threading.Lock()
+        self.in_flight = dict()  # id -> batch taken off the queues by a sender or drainer and not settled yet
+        self.in_flight_lock = threading.Condition()
+        self.drained = False  # set once stop() has collected what is left, later failures are spilled or dropped
+        self.linger_event = threading.Event()
         self.last_exception_time = 0
         self.exception_interval = 1  # seconds
-        self.recover_interval = 5  # seconds
-        self.client_index = -1
+        self.recover_interval = 5  # max seconds between checks for hosts due to reconnect
         self.client_lock = threading.RLock()
         self.event_lock = threading.RLock()
+        self.buffers_lock = threading.Lock()
+        self.local = threading.local()
+        # copied on write, so it can be iterated without holding buffers_lock
+        self.buffers = [] if per_thread_buffers else [self._new_buffer(self.event_lock, HIGH),
+                                                      self._new_buffer(self.event_lock, NORMAL)]
+        self.partitioned = dict()  # (priority, partition) -> shared StagingBuffer
         self.running = False
+        self.stopped = False
+        self.shutdown_timeout = shutdown_timeout  # seconds stop() drains for when none is given, e.g. at exit
+        self.metrics = metrics or MetricsRegistry()
+        self.events_accepted = self.metrics.counter('flume_events_accepted_total', 'Events handed to the send queue in batches')
+        self.batches_spilled = self.metrics.counter('flume_batches_spilled_total', 'Batches written to the spill queue')
+        self.batches_sent = self.metrics.counter('flume_batches_sent_total', 'Batches delivered to flume')
+        self.events_sent = self.metrics.counter('flume_events_sent_total', 'Events delivered to flume')
+        self.bytes_sent = self.metrics.counter('flume_bytes_sent_total', 'Header and body bytes delivered to flume')
+        self.gauges = []  # (gauge, func), summed over the agents sharing the registry until stop()
+        self._gauge('flume_send_queue_depth', 'Batches waiting in the send queue', self.send_queue.qsize)
+        self._gauge('flume_send_queue_bytes', 'Payload bytes waiting in the send queue, with max_queue_bytes',
+                    lambda: self.send_queue.bytes)
+        self._gauge('flume_connected_hosts', 'Hosts with an open connection', lambda: len(self.pool.connections))
+        self._gauge('flume_bad_hosts', 'Hosts waiting to be recovered', lambda: len(self.bad_hosts))
+        _agents.add(self)
+
+    def _gauge(self, name, help, func):
+        self.gauges.append((self.metrics.gauge(name, help, func=func), func))
 
     def start(self):
-        with self.client_lock:
-            for host in self.hosts:
-                try:
-                    client = self._connect(host, self.port)
-                    self.clients.append(client)
-                    self.client2host[client] = host
-                except Exception as e:
-                    self.bad_hosts[host] = time.time()
-                    logging.exception('Error when initializing clients, host is %s', host, exc_info=e)
+        """Connect to every host in parallel and return as soon as one is usable or all have failed."""
         self.running = True
+        connect_threads = [threading.Thread(target=self._initial_fill, args=(host,), daemon=True) for host in self.hosts]
+        for connect_thread in connect_threads:
+            connect_thread.start()
+        self._start_threads()
+        atexit.register(self.stop)
+        # the other hosts keep connecting in the background, bounded by connect_timeout
+        while not self.pool.connections and any(thread.is_alive() for thread in connect_threads):
+            time.sleep(0.01)
+
+    def _start_threads(self):
         recover_thread = threading.Thread(target=self._recover_runnable, daemon=True)
         recover_thread.start()
+        if self.linger_ms:
+            linger_thread = threading.Thread(target=self._linger_runnable, daemon=True)
+            linger_thread.start()
         for i in range(self.thread_size):
             send_thread = threading.Thread(target=self._send_runnable, daemon=True)
             send_thread.start()
 
-    def stop(self):
+    def _after_fork(self):
+        # the child of e.g. a preloading gunicorn master inherits locks that may be held by threads that no longer
+        # exist, sockets shared with the parent and the parent's queued batches; it starts over with none of them
+        self.client_lock = threading.RLock()
+        self.event_lock = threading.RLock()
+        self.buffers_lock = threading.Lock()
+        self.retry_lock = threading.Lock()
+        self.in_flight = dict()
+        self.in_flight_lock = threading.Condition()
+        self.local = threading.local()
+        self.linger_event = threading.Event()
+        self.recover_event = threading.Event()
+        self.metrics.after_fork()
+        self.send_queue.after_fork()
+        self.retries = []
+        self.buffers = [] if self.per_thread_buffers else [self._new_buffer(self.event_lock, HIGH),
+                                                           self._new_buffer(self.event_lock, NORMAL)]
+        self.partitioned = dict()
+        for connections in self.pool.connections.values():
+            for connection in connections:
+                try:
+                    connection.client.close()  # a plain close, the parent's connection stays open
+                except Exception:
+                    pass
+        self.pool = ConnectionPool(self.pool.balancer, self.pool.ring)
+        self.host_failures = dict()
+        self.host_rejections = dict()
+        if self.spill is not None:
+            # the parent keeps replaying its own segments
+            self.spill.after_fork()
+            self.spill = self._open_spill(own=True)
+        if self.running:
+            self.bad_hosts = {host: 0 for host in self.hosts}  # connected by the recover thread
+            self._start_threads()
+        else:
+            self.bad_hosts = dict()
+
+    def stop(self, timeout=None):
+        """Flush the staging buffers and drain the send queue over every pooled connection in parallel.
+
+        Gives up after ``timeout`` seconds (``shutdown_timeout`` by default) and
+        returns the number of events left unsent, which are spilled when a
+        spill directory is configured. Registered with atexit by ``start``.
+        """
+        if self.stopped:
+            return 0
+        self.stopped = True
         self.running = False
-        while not self.send_queue.empty():
-            client = self._get_client()
-            if not client:
-                logging.exception("There are no clients availabe to send records when stopping: %d batches of records left", self.send_queue.qsize())
-                return
+        atexit.unregister(self.stop)
+        deadline = time.time() + (self.shutdown_timeout if timeout is None else timeout)
+        for events in self._take_buffered():
+            self._put_batch(events, timeout=max(0, deadline - time.time()))
+        if self.send_queue.qsize() or self.retries:
+            # hosts waiting out their recover backoff, or not reconnected yet in a forked child, are tried right away;
+            # the drainers wait for their connections until the deadline
+            with self.client_lock:
+                self.bad_hosts = dict()
+            for host in self.hosts:
+                if self.pool.count(host) < self.connections_per_host:
+                    threading.Thread(target=self._initial_fill, args=(host,), daemon=True).start()
+        drainers = [threading.Thread(target=self._drain_runnable, args=(deadline,), daemon=True)
+                    for i in range(len(self.hosts) * self.connections_per_host)]
+        for drainer in drainers:
+            drainer.start()
+        for drainer in drainers:
+            drainer.join(max(0, deadline - time.time()))
+        with self.in_flight_lock:
+            # batches still taken by sender threads, e.g. blocked on a slow host; a retry they schedule comes in here
+            while self.in_flight and time.time() < deadline:
+                self.in_flight_lock.wait(deadline - time.time())
+            in_flight = list(self.in_flight.values())
+        with self.retry_lock:
+            self.drained = True
+            left, self.retries = [events for due, seq, events in sorted(self.retries)], []
+        left += self._take_batches(self.send_queue.qsize())
+        unsent = sum(len(events) for events in left + in_flight)
+        for gauge, func in self.gauges:
+            gauge.remove(func)
+        if left or in_flight:
+            logging.error('%d events in %d batches left unsent when stopping (%d still in flight)%s', unsent,
+                          len(left) + len(in_flight), len(in_flight), ', spilled' if self.spill is not None else '')
+            if self.spill is not None:
+                self._spill_failed(left)
+            else:
+                for events in left:
+                    self._drop(events, 'shutdown')
+        return unsent
+
+    def _drain_runnable(self, deadline):
+        # sender threads stop after their current send, then every connection drains until the deadline
+        while time.time() < deadline:
+            events, wait = self._due_retry()
+            if events is None:
+                try:
+                    events = self.send_queue.get_nowait()
+                except Empty:
+                    if wait is None and not self.in_flight:
+                        return
+                    # a batch in flight may still fail and be scheduled for a retry
+                    time.sleep(max(0, min(0.05 if wait is None else wait, deadline - time.time())))
+                    continue
+            self._claim([events])
             try:
-                events = self.send_queue.get_nowait()
-                self._send(client, events)
-            except Empty:
-                return
+                connection = self.pool.acquire(timeout=max(0, deadline - time.time()),
+                                               key=getattr(events, 'partition', None))
+                if connection is None:
+                    self._give_back(events, timeout=0)  # left for stop() to report
+                    return
+                try:
+                    self._send(connection, events)
+                finally:
+                    self.pool.release(connection)
+            finally:
+                self._settle([events])
 
     def flush(self):
-        events = None
-        with self.event_lock:
-            if len(self.events) > 0:
-                events = self.events
-                self.events = []
-        if events:
+        for events in self._take_buffered():
+            self._put_batch(events, timeout=5)
+
+    def put(self, event, priority=NORMAL, partition=None):
+        """Stage ``event``, ``priority`` HIGH batches are sent first and kept longest when the queue fills up.
+
+        With ``route_key``, ``partition`` is the event's value of that header,
+        looked up in the event when not given.
+        """
+        if self.route_key is not None and partition is None:
+            partition = self._partition_of(event)
+        if self.stopped:
+            self._put_stopped(Batch([event], priority, partition))
+            return
+        if self.route_key is not None and partition is not None:
+            buffer = self._partition_buffer(priority, partition)
+        else:
+            buffer = self.buffers[priority] if not self.per_thread_buffers else self._thread_buffer(priority)
+        with buffer.lock:
+            batches = buffer.add(event)
+        for events in batches:
+            self._put_batch(events)
+
+    def _put_stopped(self, events):
+        # e.g. records logged after the atexit stop() ran, before logging.shutdown: drained while stop() still runs,
+        # then spilled or dropped as stopped instead of left in a queue nothing reads
+        with self.retry_lock:
+            if not self.drained:
+                self._put_batch(events, timeout=0)
+                return
+        if self.spill is not None:
+            self._spill_failed([events])
+        else:
+            self._drop(events, 'stopped')
+
+    def _new_buffer(self, lock=None, priority=NORMAL, partition=None):
+        return StagingBuffer(self.batch_size, self.max_batch_bytes, lock=lock, on_start=self.linger_event.set,
+                             priority=priority, partition=partition)
+
+    def _partition_of(self, event):
+        if isinstance(event, ThriftFlumeEvent):
+            return (event.headers or {}).get(self.route_key)
+        if type(event) is DeferredEvent:
+            return event.headers.get(self.route_key)
+        return None  # pre-encoded, FlumeHandler passes its static header
+
+    def _partition_buffer(self, priority, partition):
+        if self.per_thread_buffers:
             try:
-                self.send_queue.put(events, timeout=5)
-            except Full as e:
-                logging.exception("Send queue is full when flushing", exc_info=e)
-
-    def put(self, event):
-        with self.event_lock:
-            self.events.append(event)
-            size = len(self.events)
-            if size >= self.batch_size:
-                try:
-                    self.send_queue.put_nowait(self.events)
-                except Exception as e:
-                    now = time.time()
-                    if now - self.last_exception_time > self.exception_interval:
-                        self.last_exception_time = now
-                        logging.exception('The send queue is oversize the max size: %d', self.max_size, exc_info=e)
-                self.events = []  # discarded if full
+                partitioned = self.local.partitioned
+            except AttributeError:
+                partitioned = self.local.partitioned = dict()
+            lock = None
+        else:
+            partitioned = self.partitioned
+            lock = self.event_lock
+        key = (priority, partition)
+        buffer = partitioned.get(key)
+        if buffer is None:
+            with self.buffers_lock:
+                buffer = partitioned.get(key)
+                if buffer is None:
+                    buffer = partitioned[key] = self._new_buffer(lock, priority, partition)
+                    self.buffers = self.buffers + [buffer]
+        return buffer
+
+    def _thread_buffer(self, priority):
+        try:
+            return self.local.buffers[priority]
+        except AttributeError:
+            lock = threading.Lock()
+            buffers = self.local.buffers = [self._new_buffer(lock, HIGH), self._new_buffer(lock, NORMAL)]
+            with self.buffers_lock:
+                self.buffers = self.buffers + buffers
+            return buffers[priority]
+
+    def _take_buffered(self):
+        batches = []
+        dead = []
+        for buffer in self.buffers:
+            with buffer.lock:
+                if buffer.events:
+                    batches.append(buffer.take())
+            if self.per_thread_buffers and not buffer.thread.is_alive():
+                dead.append(buffer)
+        if dead:
+            with self.buffers_lock:
+                self.buffers = [buffer for buffer in self.buffers if buffer not in dead]
+        return batches
+
+    def _put_batch(self, events, timeout=None):
+        if self.max_queue_bytes:
+            # an encoded event is one bytes object, and its size is exactly what is sent
+            events[:] = map(to_bytes, events)
+        discarded = self.send_queue.put(events, timeout)
+        if events and all(batch is not events for batch, reason in discarded):
+            self.events_accepted.inc(len(events))
+        for batch, reason in discarded:
+            if reason == 'sampled':
+                self._drop(batch, reason)
+                continue
+            if self.spill is not None:
+                self._spill_failed([batch])
+                continue
+            self._drop(batch, reason)
+            now = time.time()
+            if now - self.last_exception_time > self.exception_interval:
+                self.last_exception_time = now
+                logging.error('The send queue is oversize the max size: %d', self.max_size)
+
+    def _linger_runnable(self):
+        linger = self.linger_ms / 1000
+        while self.running:
+            started = min((buffer.started for buffer in self.buffers if buffer.started is not None), default=None)
+            if started is None:
+                self.linger_event.wait(timeout=1)  # timeout can give chance to exit
+                self.linger_event.clear()
+                continue
+            remaining = started + linger - time.time()
+            if remaining > 0:
+                time.sleep(remaining)
+            else:
+                self.flush()
 
     def _send_runnable(self):
         while self.running:
-            client = self._get_client()
-            if not client:
-                time.sleep(2)
-                continue  # all clients are disconnected!
+            events = self._next_batch()
+            if events is None:
+                continue
+            batches = [events]
+            try:
+                # the batch is picked first, so the balancer chooses among connections when there is work
+                connection = None
+                while connection is None and self.running:
+                    # None while all clients are disconnected
+                    connection = self.pool.acquire(timeout=2, key=getattr(events, 'partition', None))
+                if connection is None:
+                    self._give_back(events)  # stopping, leave the batch to the drain in stop()
+                    return
+                try:
+                    # with route_key the other queued batches may belong on other hosts
+                    if self.pipeline_window > 1 and self.route_key is None:
+                        batches += self._take_batches(self.pipeline_window - 1)
+                        self._claim(batches[1:])
+                        self._send_pipelined(connection, batches)
+                    else:
+                        self._send(connection, events)
+                finally:
+                    self.pool.release(connection)
+            finally:
+                self._settle(batches)
+
+    def _next_batch(self):
+        events, wait = self._due_retry()
+        if events is None and self.spill is not None and not self.spill.empty():
             try:
-                # timeout can give chance to exit
-                events = self.send_queue.get(block=True, timeout=3)
-                self._send(client, events)
+                events = self.send_queue.get_nowait()
             except Empty:
-                self.flush()
+                events = self.spill.get()  # replay once the live queue is drained
+        if events is None:
+            timeout = 3 if wait is None else min(3, wait)
+            try:
+                # timeout can give chance to exit, or to pick up the next retry
+                events = self.send_queue.get(block=True, timeout=timeout)
+            except Empty:
+                if timeout == 3:
+                    self.flush()
+                return None
+        if events is not None:
+            self._claim([events])
+        return events
+
+    def _claim(self, batches):
+        with self.in_flight_lock:
+            for events in batches:
+                self.in_flight[id(events)] = events
+
+    def _settle(self, batches):
+        # the batch was delivered, scheduled for a retry, spilled, dropped or put back by now
+        with self.in_flight_lock:
+            for events in batches:
+                self.in_flight.pop(id(events), None)
+            self.in_flight_lock.notify_all()
+
+    def _give_back(self, events, timeout=None):
+        if self.drained:
+            self._spill_failed([events])
+        else:
+            self._put_batch(events, timeout)
+
+    def _take_batches(self, count):
+        batches = []
+        while len(batches) < count:
+            try:
+                batches.append(self.send_queue.get_nowait())
+            except Empty:
+                break
+        return batches
+
+    def _send(self, connection: Connection, events):
+        if not render_batch(events):
+            return
+        start = time.time()
+        try:
+            status = connection.client.appendBatch(events)
+        except Exception as e:
+            self._on_send_error(connection, e)
+            self._on_failed([events])
+            return
+        self._on_replied(connection, [events], [status], time.time() - start)
 
-    def _send(self, client, events):
+    def _send_pipelined(self, connection: Connection, batches):
+        batches = [events for events in batches if render_batch(events)]
+        if not batches:
+            return
+        start = time.time()
         try:
-            client.appendBatch(events)
+            statuses = connection.client.appendBatches(batches)
         except Exception as e:
-            host = self.client2host[client]
-            logging.exception('Error when sending events to flume, host is %s', host, exc_info=e)
+            self._on_send_error(connection, e)
+            self._on_failed(batches)  # replies are lost, so every batch in flight may be undelivered
+            return
+        self._on_replied(connection, batches, statuses, time.time() - start)
+
+    def _on_replied(self, connection, batches, statuses, rtt):
+        rejected = [events for events, status in zip(batches, statuses) if status != Status.OK]
+        if rejected:
+            self._on_rejected(connection, rejected)
+            batches = [events for events, status in zip(batches, statuses) if status == Status.OK]
+        if batches:
+            self._on_sent(connection, batches, rtt)
+
+    def _on_rejected(self, connection, batches):
+        # flume is overloaded (e.g. its channel is full), not broken: back off from the host, keep the connection
+        host = connection.host
+        self.metrics.counter('flume_batches_rejected_total', 'Batches answered with a status other than OK',
+                             host=host).inc(len(batches))
+        with self.client_lock:
+            rejections = self.host_rejections.get(host, 0)
+            self.host_rejections[host] = rejections + 1
+        cooldown = min(self.max_cooldown, self.cooldown * 2 ** rejections)
+        self.pool.cool_down(host, random.uniform(cooldown / 2, cooldown))
+        now = time.time()
+        for events in batches:
+            if not isinstance(events, Batch):
+                events = Batch(events)  # replayed from the spill queue
+            if now - events.created > self.retry_deadline:
+                self._expire(events)
+            else:
+                self._schedule(events, now)  # sent again right away, through another host
+
+    def _on_sent(self, connection, batches, rtt):
+        host = connection.host
+        if host in self.host_failures or host in self.host_rejections:
             with self.client_lock:
-                self.bad_hosts[host] = time.time()
-                if client in self.clients:
-                    self.clients.remove(client)
-                try:
-                    client.close()
-                except Exception:
-                    pass
+                self.host_failures.pop(host, None)  # healthy again, the next failure starts a new backoff
+                self.host_rejections.pop(host, None)
+        self.pool.observe(connection, rtt / len(batches))
+        self.metrics.histogram('flume_send_seconds', 'appendBatch round trip time', host=host).observe(rtt)
+        self.batches_sent.inc(len(batches))
+        self.events_sent.inc(sum(len(events) for events in batches))
+        self.bytes_sent.inc(sum(event_size(event) for events in batches for event in events))
+
+    def _on_failed(self, batches):
+        given_up = [events for events in batches if not self._retry(events)]
+        if given_up:
+            self._spill_failed(given_up)
+
+    def _retry(self, events):
+        if not self.retry_attempts:
+            return False
+        if not isinstance(events, Batch):
+            events = Batch(events)  # replayed from the spill queue
+        events.attempts += 1
+        if events.attempts > self.retry_attempts:
+            return False
+        now = time.time()
+        if now - events.created > self.retry_deadline:
+            self._expire(events)
+            return True
+        if events.attempts == 1 and self.pool.connections:
+            due = now  # move to another healthy connection right away
+        else:
+            due = now + random.uniform(0, min(self.retry_max_backoff, self.retry_backoff * 2 ** events.attempts))
+        self._schedule(events, due)
+        return True
+
+    def _schedule(self, events, due):
+        with self.retry_lock:
+            if not self.drained:
+                self.retry_seq += 1
+                heapq.heappush(self.retries, (due, self.retry_seq, events))
+        if self.drained:  # failed after stop() gave up on it
+            self._spill_failed([events])
+            return
+        self.metrics.counter('flume_batches_retried_total', 'Batches scheduled to be sent again').inc()
+
+    def _due_retry(self):
+        # returns (batch, None) for a due retry, else (None, seconds until the next one or None)
+        with self.retry_lock:
+            if not self.retries:
+                return None, None
+            due = self.retries[0][0] - time.time()
+            if due > 0:
+                return None, due
+            return heapq.heappop(self.retries)[2], None
+
+    def _expire(self, events):
+        # past retry_deadline: kept on disk for a later replay when possible, like any other failed batch
+        if self.spill is not None:
+            self._spill_failed([events])
+        else:
+            self._drop(events, 'expired')
+
+    def _spill_failed(self, batches):
+        if self.spill is not None:
+            for events in batches:
+                if self.spill.put(render_batch(events)):
+                    self.batches_spilled.inc()
+                else:
+                    self._drop(events, 'spill_full')  # the other processes' segments fill spill_max_bytes
+        else:
+            for events in batches:
+                self._drop(events, 'send_failed')
+
+    def _drop(self, events, reason):
+        self.metrics.counter('flume_batches_dropped_total', 'Batches discarded', reason=reason).inc()
+        self.metrics.counter('flume_events_dropped_total', 'Events discarded', reason=reason).inc(len(events))
+
+    def _on_send_error(self, connection, e):
+        host = connection.host
+        self.metrics.counter('flume_send_failures_total', 'Failed appendBatch calls', host=host).inc()
+        logging.exception('Error when sending events to flume, host is %s', host, exc_info=e)
+        self._mark_bad(host)
+        self.pool.discard(connection)
+
+    def _mark_bad(self, host):
+        with self.client_lock:
+            failures = self.host_failures.get(host, 0)
+            self.host_failures[host] = failures + 1
+            backoff = min(self.recover_max_backoff, self.recover_backoff * 2 ** failures)
+            self.bad_hosts[host] = time.time() + random.uniform(backoff / 2, backoff)
+        self.recover_event.set()
+
+    def _initial_fill(self, host):
+        try:
+            self._fill(host)
+        except Exception as e:
+            self._mark_bad(host)
+            logging.exception('Error when initializing clients, host is %s', host, exc_info=e)
 
     def _recover_runnable(self):
         while self.running:
-            bad_hosts = self.bad_hosts.copy()
-            for host, timestamp in bad_hosts.items():
-                if time.time() - timestamp >= self.recover_interval:
-                    try:
-                        client = self._connect(host, self.port)
-                        with self.client_lock:
-                            self.clients.append(client)
-                            self.client2host[client] = host
-                            self.bad_hosts.pop(host)
-                    except Exception as e:
-                        with self.client_lock:
-                            self.bad_hosts[host] = time.time()
-                        logging.exception('Error when recovering clients, host is %s', host, exc_info=e)
-            time.sleep(self.recover_interval)
-
-    def _get_client(self) -> Client:
-        with self.client_lock:
-            if len(self.clients) == 0:
-                return None  # no clients
-            self.client_index += 1
-            if self.client_index >= len(self.clients):
-                self.client_index = 0
-            return self.clients[self.client_index]
-
-    def _connect(self, host, port) -> Client:
-        socket = TSocket(host, port)
-        transport = TFramedTransport(socket)
-        protocol = TCompactProtocol(transport)
-        client = Client(protocol)
-        transport.open()
-        return client
\ No newline at end of file
+            now = time.time()
+            with self.client_lock:
+                due = [host for host, at in self.bad_hosts.items() if at <= now]
+                for host in due:
+                    del self.bad_hosts[host]  # unmark first, a send failing on a fresh connection marks the host again
+                next_attempt = min(self.bad_hosts.values(), default=now + self.recover_interval)
+            for host in due:
+                # in parallel, so a blackholed host does not hold back the others
+                threading.Thread(target=self._recover, args=(host,), daemon=True).start()
+            if self.spill is not None and now - self.adopt_time >= self.recover_interval:
+                self.adopt_time = now
+                self._adopt_orphans()
+            self.recover_event.wait(max(0, min(next_attempt - now, self.recover_interval)))
+            self.recover_event.clear()
+
+    def _open_spill(self, own=False):
+        # one process owns spill_dir, every other one, e.g. a gunicorn worker, spills to its own subdirectory
+        if not own:
+            try:
+                return SpillQueue(self.spill_dir, max_bytes=self.spill_max_bytes, root=self.spill_dir)
+            except BlockingIOError:
+                pass
+        return SpillQueue(os.path.join(self.spill_dir, 'pid-%d' % os.getpid()), max_bytes=self.spill_max_bytes,
+                          root=self.spill_dir)
+
+    def _adopt_orphans(self):
+        # a process that exited, e.g. a recycled gunicorn worker, leaves its spilled batches behind
+        try:
+            if self.spill.directory != self.spill_dir:
+                self.spill.adopt(self.spill_dir, remove=False)
+            for name in os.listdir(self.spill_dir):
+                path = os.path.join(self.spill_dir, name)
+                if name.startswith('pid-') and path != self.spill.directory:
+                    self.spill.adopt(path)
+        except OSError as e:
+            logging.exception('Error when adopting spilled batches in %s', self.spill_dir, exc_info=e)
+
+    def _recover(self, host):
+        try:
+            self._fill(host)
+        except Exception as e:
+            self._mark_bad(host)
+            logging.exception('Error when recovering clients, host is %s', host, exc_info=e)
+
+    def _fill(self, host):
+        # open the connections missing to reach connections_per_host
+        for i in range(self.connections_per_host - self.pool.count(host)):
+            self.pool.add(host, self._connect(host, self.port))
+
+    def _connect(self, host, port) -> FlumeClient:
+        return self.transport.connect(host, port)
\ No newline at end of file
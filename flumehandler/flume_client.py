@@ -0,0 +1,97 @@
+import os
+import struct
+import threading
+from thrift.Thrift import TMessageType, TApplicationException
+from .thrift_protocol import Client, appendBatch_result
+from .thrift_encoder import encode_batch, batch_segments
+
+MAX_SEQID = 2 ** 31 - 1
+_IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') and 'SC_IOV_MAX' in os.sysconf_names else 1024
+
+
+def sendmsg_all(sock, segments):
+    """Write ``segments`` in order with as few ``sendmsg`` calls as possible, resuming after partial writes."""
+    views = [memoryview(segment) for segment in segments]
+    i = 0
+    while i < len(views):
+        sent = sock.sendmsg(views[i:i + _IOV_MAX])
+        while sent:
+            size = views[i].nbytes
+            if sent < size:
+                views[i] = views[i][sent:]
+                break
+            sent -= size
+            i += 1
+        while i < len(views) and not views[i].nbytes:
+            i += 1
+
+
+class FlumeClient(Client):
+    """With ``sock``, the socket under the framed transport, batch frames are written by scatter-gather I/O."""
+
+    def __init__(self, iprot, oprot=None, sock=None):
+        super().__init__(iprot, oprot)
+        self._sock = sock
+
+    def send_appendBatch(self, events):
+        if self._sock is not None:
+            # frame length, message header, event headers and bodies go out as separate buffers, never joined
+            segments = batch_segments(events, self._seqid)
+            segments.insert(0, struct.pack('!i', sum(map(len, segments))))
+            sendmsg_all(self._sock, segments)
+            return
+        # pre-encoded events are joined under the message header instead of re-walking the structs
+        if not any(isinstance(event, bytes) for event in events):
+            return super().send_appendBatch(events)
+        trans = self._oprot.trans
+        trans.write(encode_batch(events, self._seqid))
+        trans.flush()
+
+    def appendBatches(self, batches):
+        return [self.appendBatch(events) for events in batches]
+
+    def close(self):
+        self._oprot.trans.close()
+
+
+class PipelinedFlumeClient(FlumeClient):
+    """Writes several appendBatch calls back-to-back and matches the replies by seqid."""
+
+    def __init__(self, iprot, oprot=None, window=8, sock=None):
+        super().__init__(iprot, oprot, sock)
+        self.window = window
+        self._lock = threading.Lock()
+
+    def appendBatch(self, events):
+        return self.appendBatches([events])[0]
+
+    def appendBatches(self, batches):
+        statuses = [None] * len(batches)
+        with self._lock:
+            pending = dict()  # seqid -> index of the batch
+            for i, events in enumerate(batches):
+                if len(pending) >= self.window:
+                    self._recv_reply(pending, statuses)
+                self._seqid = self._seqid + 1 if self._seqid < MAX_SEQID else 1
+                self.send_appendBatch(events)
+                pending[self._seqid] = i
+            while pending:
+                self._recv_reply(pending, statuses)
+        return statuses
+
+    def _recv_reply(self, pending, statuses):
+        iprot = self._iprot
+        (fname, mtype, rseqid) = iprot.readMessageBegin()
+        if mtype == TMessageType.EXCEPTION:
+            x = TApplicationException()
+            x.read(iprot)
+            iprot.readMessageEnd()
+            raise x
+        result = appendBatch_result()
+        result.read(iprot)
+        iprot.readMessageEnd()
+        if rseqid not in pending:
+            raise TApplicationException(TApplicationException.BAD_SEQUENCE_ID, "appendBatch failed: out of sequence response %d" % rseqid)
+        if result.success is None:
+            raise TApplicationException(TApplicationException.MISSING_RESULT, "appendBatch failed: unknown result")
+        statuses[pending.pop(rseqid)] = result.success
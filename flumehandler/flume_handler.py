@@ -1,16 +1,40 @@
 
 import logging
 from .thrift_ttypes import ThriftFlumeEvent
+from .thrift_encoder import encode_event, encode_headers
 from .flume_agent import FlumeAgent
+from .metrics import MetricsRegistry
+from .batch import HIGH, NORMAL
+from .rate_limit import RecordLimiter
+from .deferred import DeferredEvent
+from .coalesce import RecordCoalescer
+
+_NO_HEADERS = {}
 
 
 class FlumeHandler(logging.Handler):
 
-    def __init__(self, flume_agent: FlumeAgent, **kwargs):
+    def __init__(self, flume_agent: FlumeAgent, *, pre_encode=False, lazy_format=False, priority_level=logging.WARNING,
+                 rate_limit=None, rate_limits=None, sample_rate=1.0, sample_key=None, summary_interval=60,
+                 coalesce_window=None, **kwargs):
         super().__init__()
         self.flume_agent = flume_agent
+        self.pre_encode = pre_encode  # serialize events into compact protocol bytes once, at emit time
+        self.lazy_format = lazy_format  # format and encode records on the agent's sender threads
+        self.priority_level = priority_level  # records at or above this level go to the agent's HIGH lane
+        # records over a (rate, burst) token bucket or sampled out are suppressed before they are formatted
+        if rate_limit or rate_limits or sample_rate < 1:
+            self.limiter = RecordLimiter(rate_limit, rate_limits, sample_rate, sample_key, summary_interval)
+        else:
+            self.limiter = None
+        # repeats of a record within coalesce_window seconds are replaced by one summary record
+        self.coalescer = RecordCoalescer(coalesce_window) if coalesce_window else None
         self.headers = kwargs
         self.envs = dict()
+        self._split()
+        self.route_key = getattr(flume_agent, 'route_key', None)
+        self.metrics = getattr(flume_agent, 'metrics', None) or MetricsRegistry()
+        self.errors = self.metrics.counter('flume_handler_errors_total', 'Records that failed to convert or enqueue')
 
     def set_header(self, *args, **kwargs):
         if len(args) % 2 != 0:
@@ -20,6 +44,7 @@ class FlumeHandler(logging.Handler):
             self.headers[args[2*i]] = args[2*i+1]
             i += 1
         self.headers.update(kwargs)
+        self._split()
 
     def set_env(self, *args, **kwargs):
         if len(args) % 2 != 0:
@@ -29,23 +54,119 @@ class FlumeHandler(logging.Handler):
             self.envs[args[2*i]] = args[2*i+1]
             i += 1
         self.envs.update(kwargs)
+        self._split()
+
+    def _split(self):
+        # static values are resolved once here, only callables are evaluated per record
+        self.static_headers = {k: v for k, v in self.headers.items() if not callable(v)}
+        self.dynamic_headers = {k: v for k, v in self.headers.items() if callable(v)}
+        self.static_header_bytes = encode_headers(self.static_headers)
+        self.static_envs = {k: v for k, v in self.envs.items() if not callable(v)}
+        self.dynamic_envs = {k: v for k, v in self.envs.items() if callable(v)}
 
     def flush(self):
         super().flush()
+        self._flush_summaries()
         self.flume_agent.flush()
 
+    def _flush_summaries(self):
+        if self.coalescer is not None:
+            for summary in self.coalescer.due_summaries(force=True):
+                self._ship(summary)
+        if self.limiter is not None:
+            for summary in self.limiter.due_summaries(force=True):
+                self._ship(summary)
+
     def close(self):
         super().close()
+        self._flush_summaries()
         self.flume_agent.stop()
 
+    def handle(self, record):
+        # no handler-wide lock around emit: the agent, limiter and coalescer synchronize themselves, so logging
+        # threads only meet on the agent's staging buffers (one per thread with per_thread_buffers)
+        rv = self.filter(record)
+        if isinstance(rv, logging.LogRecord):
+            record = rv  # python 3.12 filters may return a replacement record
+        if rv:
+            self.emit(record)
+        return rv
+
     def emit(self, record):
-        event = self.convert(record)
-        self.flume_agent.put(event)
+        try:
+            if self.coalescer is not None and not self._coalesce(record):
+                return
+            if self.limiter is None or self._admit(record):
+                self._ship(record)
+        except Exception:
+            self.errors.inc()
+            self.handleError(record)
+
+    def _ship(self, record):
+        if self.lazy_format and not record.exc_info:
+            event = self.capture(record)
+        else:
+            event = self.convert(record)  # tracebacks are formatted while their frames are current
+        priority = HIGH if record.levelno >= self.priority_level else NORMAL
+        if self.route_key is not None:
+            self.flume_agent.put(event, priority, self.static_headers.get(self.route_key))
+        else:
+            self.flume_agent.put(event, priority)
+
+    def _coalesce(self, record):
+        for summary in self.coalescer.due_summaries():
+            self._ship(summary)
+        if self.coalescer.check(record):
+            return True
+        self.metrics.counter('flume_handler_coalesced_total', 'Repeated records folded into a summary').inc()
+        return False
+
+    def _admit(self, record):
+        for summary in self.limiter.due_summaries():
+            self._ship(summary)
+        reason = self.limiter.check(record)
+        if reason is None:
+            return True
+        self.metrics.counter('flume_handler_suppressed_total', 'Records rate limited or sampled out', reason=reason).inc()
+        return False
 
     def convert(self, record):
-        headers = self.evaluate(self.headers)
-        record.args.update(self.evaluate(self.envs))
-        body = bytes(self.format(record), 'utf8')
+        self._apply_envs(record.args)
+        dynamic = self.evaluate(self.dynamic_headers) if self.dynamic_headers else _NO_HEADERS
+        return self._event(bytes(self.format(record), 'utf8'), dynamic)
+
+    def capture(self, record):
+        """Snapshot ``record`` for a sender thread to format: args are copied and callables evaluated now."""
+        record.args = dict(record.args)
+        self._apply_envs(record.args)
+        dynamic = self.evaluate(self.dynamic_headers) if self.dynamic_headers else _NO_HEADERS
+        # template plus the str and bytes args, which make up most of a large message
+        size = len(record.msg) if isinstance(record.msg, str) else 0
+        size += sum(len(v) for v in record.args.values() if isinstance(v, (str, bytes)))
+        size += sum(len(k) + len(v) for k, v in dynamic.items())
+        return DeferredEvent(self._render, record, dynamic, size + len(self.static_header_bytes))
+
+    def _render(self, record, dynamic):
+        try:
+            return self._event(bytes(self.format(record), 'utf8'), dynamic)
+        except Exception:
+            self.errors.inc()
+            self.handleError(record)
+            return None
+
+    def _apply_envs(self, args):
+        args.update(self.static_envs)
+        for k, v in self.dynamic_envs.items():
+            args[k] = v()
+
+    def _event(self, body, dynamic):
+        if self.pre_encode:
+            return encode_event(dynamic, body, self.static_header_bytes, len(self.static_headers))
+        if dynamic:
+            headers = dict(self.static_headers)
+            headers.update(dynamic)
+        else:
+            headers = self.static_headers  # shared by every event, never mutated
         return ThriftFlumeEvent(headers=headers, body=body)
 
     def evaluate(self, d):
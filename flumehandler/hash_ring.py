@@ -0,0 +1,51 @@
+import bisect
+import hashlib
+import math
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of partition keys onto hosts, with bounded loads.
+
+    Every host owns ``replicas`` points of the ring. A key goes to the first
+    host clockwise from its hash that is usable and whose load stays within
+    ``load_factor`` times the average, or within its capacity, so a host
+    going bad or coming back only moves the keys it owns.
+    """
+
+    def __init__(self, hosts, replicas=100, load_factor=1.25):
+        points = sorted((_hash('%s#%d' % (host, i)), host) for host in hosts for i in range(replicas))
+        self.hashes = [point for point, host in points]
+        self.points = [host for point, host in points]
+        self.size = len(set(hosts))
+        self.load_factor = load_factor
+        self.preferences = dict()  # key -> every host, in ring order from the key
+
+    def preference(self, key):
+        order = self.preferences.get(key)
+        if order is None:
+            start = bisect.bisect(self.hashes, _hash(key))
+            order = []
+            for i in range(len(self.points)):
+                host = self.points[(start + i) % len(self.points)]
+                if host not in order:
+                    order.append(host)
+                    if len(order) == self.size:
+                        break
+            if len(self.preferences) > 10000:
+                self.preferences.clear()
+            self.preferences[key] = order
+        return order
+
+    def choose(self, key, loads, capacities):
+        """Return the host for ``key`` among the usable hosts, the keys of ``loads``, or None if there is none."""
+        if not loads:
+            return None
+        bound = math.ceil(self.load_factor * (sum(loads.values()) + 1) / len(loads))
+        for host in self.preference(key):
+            if host in loads and loads[host] + 1 <= max(bound, capacities[host]):
+                return host
+        return None
@@ -0,0 +1,162 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """A value that is set, or the sum of the funcs sampled at snapshot time, e.g. one per agent sharing it."""
+    type = 'gauge'
+
+    def __init__(self, func=None):
+        self.value = 0
+        self.funcs = [func] if func is not None else []
+
+    def set(self, value):
+        self.value = value
+
+    def add(self, func):
+        self.funcs = self.funcs + [func]  # copied on write, so snapshot needs no lock
+
+    def remove(self, func):
+        self.funcs = [f for f in self.funcs if f is not func]
+
+    def snapshot(self):
+        return sum(func() for func in self.funcs) if self.funcs else self.value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = []
+        n = 0
+        for count in counts:
+            n += count
+            cumulative.append(n)
+        buckets = dict(zip(self.buckets + (float('inf'),), cumulative))
+        return {'buckets': buckets, 'sum': total, 'count': n}
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % (k, v) for k, v in labels))
+
+
+class MetricsRegistry:
+    """Named counters, gauges and histograms, optionally labelled, e.g. by host."""
+
+    def __init__(self):
+        self.metrics = dict()  # (name, labels) -> metric
+        self.helps = dict()
+        self.lock = threading.Lock()
+
+    def counter(self, name, help='', **labels) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', func=None, **labels) -> Gauge:
+        """With ``func``, adds it to the funcs the gauge sums if the gauge exists already."""
+        gauge = self._get(Gauge, name, help, labels, func)
+        if func is not None and func not in gauge.funcs:
+            gauge.add(func)
+        return gauge
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS, **labels) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def _get(self, cls, name, help, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = self.metrics[key] = cls(*args)
+                    self.helps.setdefault(name, help)
+        return metric
+
+    def after_fork(self):
+        """Replace the locks inherited from the parent process, which may be held by threads that do not exist here."""
+        self.lock = threading.Lock()
+        for metric in list(self.metrics.values()):
+            if hasattr(metric, 'lock'):
+                metric.lock = threading.Lock()
+
+    def snapshot(self):
+        """Current values keyed by series, e.g. ``{'flume_send_failures_total{host="a"}': 3}``."""
+        return {_series(name, labels): metric.snapshot() for (name, labels), metric in list(self.metrics.items())}
+
+    def to_prometheus(self):
+        lines = []
+        seen = set()
+        for (name, labels), metric in sorted(list(self.metrics.items()), key=lambda item: item[0]):
+            if name not in seen:
+                seen.add(name)
+                if self.helps.get(name):
+                    lines.append('# HELP %s %s' % (name, self.helps[name]))
+                lines.append('# TYPE %s %s' % (name, metric.type))
+            value = metric.snapshot()
+            if metric.type != 'histogram':
+                lines.append('%s %s' % (_series(name, labels), value))
+                continue
+            for le, count in value['buckets'].items():
+                le = '+Inf' if le == float('inf') else repr(le)
+                lines.append('%s %d' % (_series(name + '_bucket', labels + (('le', le),)), count))
+            lines.append('%s %s' % (_series(name + '_sum', labels), value['sum']))
+            lines.append('%s %d' % (_series(name + '_count', labels), value['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def serve_prometheus(registry, port, host=''):
+    """Expose ``registry`` in the Prometheus text format on http://host:port/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = registry.to_prometheus().encode('utf8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
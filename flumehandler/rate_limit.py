@@ -0,0 +1,110 @@
+import logging
+import random
+import threading
+import time
+import zlib
+
+
+class TokenBucket:
+    """Allows ``rate`` records per second on average and bursts of up to ``burst`` records."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RecordLimiter:
+    """Decides whether a record is shipped before it is formatted, and counts the ones it suppresses.
+
+    Records are sampled by a hash of ``sample_key``, a record attribute or a
+    key of ``record.args`` (or a callable taking the record), so every record
+    of one request is kept or suppressed together; records without the key
+    are sampled at random. Records that are sampled in then go through a
+    token bucket per logger and level. ``rate_limits`` overrides the default
+    ``(rate, burst)`` by logger name or by ``(logger name, level)``.
+
+    Thread-safe; its lock is only held for the bookkeeping of one record.
+    """
+
+    def __init__(self, rate_limit=None, rate_limits=None, sample_rate=1.0, sample_key=None, summary_interval=60):
+        self.rate_limit = rate_limit
+        self.rate_limits = rate_limits or dict()
+        self.sample_rate = sample_rate
+        self.sample_key = sample_key
+        self.summary_interval = summary_interval  # seconds
+        self.buckets = dict()  # (logger name, level) -> TokenBucket or None
+        self.suppressed = dict()  # (logger name, level) -> {reason: count}
+        self.since = time.time()
+        self.lock = threading.Lock()
+
+    def check(self, record):
+        """Return None when ``record`` should be shipped, else the reason it is suppressed."""
+        if self.sample_rate < 1 and not self._sampled(record):
+            reason = 'sampled'
+        else:
+            with self.lock:
+                if self._bucket_allows(record):
+                    return None
+            reason = 'rate_limited'
+        with self.lock:
+            counts = self.suppressed.setdefault((record.name, record.levelno), dict())
+            counts[reason] = counts.get(reason, 0) + 1
+        return reason
+
+    def due_summaries(self, force=False):
+        """Return summary records of the counts suppressed since the last call, once per ``summary_interval``.
+
+        With ``force`` they are returned right away, e.g. on flush.
+        """
+        now = time.time()
+        if not force and now - self.since < self.summary_interval:
+            return []
+        with self.lock:
+            if not force and now - self.since < self.summary_interval:
+                return []  # taken by another thread meanwhile
+            suppressed, since = self.suppressed, self.since
+            self.suppressed = dict()
+            self.since = now
+        records = []
+        for (name, level), counts in suppressed.items():
+            args = {'rate_limited': counts.get('rate_limited', 0), 'sampled': counts.get('sampled', 0),
+                    'since': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(since))}
+            records.append(logging.LogRecord(
+                name, level, __file__, 0,
+                'suppressed %(rate_limited)d rate limited and %(sampled)d sampled records since %(since)s',
+                (args,), None))
+        return records
+
+    def _sampled(self, record):
+        key = self.sample_key
+        if callable(key):
+            value = key(record)
+        elif key is not None:
+            value = getattr(record, key, None)
+            if value is None and isinstance(record.args, dict):
+                value = record.args.get(key)
+        else:
+            value = None
+        if value is None:
+            return random.random() < self.sample_rate
+        return zlib.crc32(str(value).encode('utf8')) < self.sample_rate * 0x100000000
+
+    def _bucket_allows(self, record):
+        key = (record.name, record.levelno)
+        try:
+            bucket = self.buckets[key]
+        except KeyError:
+            limit = self.rate_limits.get(key, self.rate_limits.get(record.name, self.rate_limit))
+            bucket = self.buckets[key] = TokenBucket(*limit) if limit else None
+        return bucket is None or bucket.take()
@@ -0,0 +1,21 @@
+import time
+
+
+class Refreshed:
+    """Callable header/env value whose result is memoized for ``interval`` seconds.
+
+    handler.set_env('{datetime}e', Refreshed(time.time, 1))
+    """
+
+    def __init__(self, func, interval):
+        self.func = func
+        self.interval = interval  # seconds
+        self.value = None
+        self.expires = 0
+
+    def __call__(self):
+        now = time.time()
+        if now >= self.expires:
+            self.value = self.func()
+            self.expires = now + self.interval
+        return self.value
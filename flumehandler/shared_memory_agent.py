@@ -0,0 +1,105 @@
+import os
+import fcntl
+import logging
+import tempfile
+import threading
+import time
+from .flume_agent import FlumeAgent
+from .shared_ring import SharedRing
+from .thrift_encoder import to_bytes
+from .deferred import DeferredEvent
+
+
+class SharedMemoryAgent:
+    """Agent for pre-fork servers that funnels the events of all workers through one shipper.
+
+    Every worker process writes encoded events into the ``SharedRing`` called
+    ``name``. With ``elect=True`` the workers elect one of themselves through
+    an exclusive ``flock``; the winner drains the ring into a regular
+    ``FlumeAgent`` built from ``agent_kwargs``, and another worker takes over
+    when it exits. With ``elect=False`` the ring is expected to be drained by
+    ``ship`` running in a separately spawned process.
+    """
+
+    def __init__(self, name, ring_size=64 * 1024 * 1024, elect=True, **agent_kwargs):
+        self.name = name
+        self.ring_size = ring_size
+        self.elect = elect
+        self.agent_kwargs = agent_kwargs
+        self.ring = None
+        self.shipper = None
+        self.election_interval = 1  # seconds
+        self.running = False
+
+    def start(self):
+        self.ring = SharedRing(self.name, self.ring_size)
+        self.running = True
+        if self.elect:
+            election_thread = threading.Thread(target=self._election_runnable, daemon=True)
+            election_thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.shipper is not None:
+            self.shipper.stop()
+
+    def flush(self):
+        pass  # batches are cut by the shipper
+
+    def put(self, event, priority=None):
+        if type(event) is DeferredEvent:
+            event = event.render()  # the ring holds encoded events, so render in the worker
+            if event is None:
+                return
+        self.ring.put(to_bytes(event))  # the ring has one lane
+
+    def _election_runnable(self):
+        path = os.path.join(tempfile.gettempdir(), '%s.shipper' % self.name)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        while self.running:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                time.sleep(self.election_interval)
+                continue
+            # the lock is held until this process exits
+            self.shipper = _Shipper(self.ring, FlumeAgent(**self.agent_kwargs))
+            self.shipper.run(lambda: self.running)
+            return
+
+
+class _Shipper:
+
+    def __init__(self, ring, agent):
+        self.ring = ring
+        self.agent = agent
+        self.idle_interval = 0.05  # seconds
+        self.last_exception_time = 0
+        self.exception_interval = 1  # seconds
+
+    def run(self, running):
+        self.agent.start()
+        while running():
+            events, dropped = self.ring.get_many(self.agent.batch_size)
+            if dropped:
+                now = time.time()
+                if now - self.last_exception_time > self.exception_interval:
+                    self.last_exception_time = now
+                    logging.error('The shared ring %s is full, %d events discarded', self.ring.name, dropped)
+            for event in events:
+                self.agent.put(event)
+            if not events:
+                time.sleep(self.idle_interval)
+
+    def stop(self):
+        events, dropped = self.ring.get_many(self.ring.capacity)
+        for event in events:
+            self.agent.put(event)
+        self.agent.flush()
+        self.agent.stop()
+
+
+def ship(name, ring_size=64 * 1024 * 1024, **agent_kwargs):
+    """Drain the shared ring ``name`` into a FlumeAgent forever, for use as the target of a shipper process."""
+    ring = SharedRing(name, ring_size)
+    _Shipper(ring, FlumeAgent(**agent_kwargs)).run(lambda: True)
@@ -0,0 +1,124 @@
+import os
+import fcntl
+import struct
+import tempfile
+import threading
+from multiprocessing import shared_memory
+
+_HEADER = struct.Struct('!QQQ')  # read position, write position, dropped records
+_LENGTH = struct.Struct('!I')
+
+
+def _open(name, create=False, size=0):
+    # untracked, so the segment outlives whichever worker created or attached it
+    try:
+        return shared_memory.SharedMemory(name, create=create, size=size, track=False)
+    except TypeError:  # python < 3.13 always tracks, which unlinks the segment when this process exits
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name, create=create, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedRing:
+    """Multi-producer ring buffer of length-prefixed records in POSIX shared memory.
+
+    Any process that knows ``name`` can attach to it. Access is serialized
+    with ``flock`` on a lock file, which also works between unrelated and
+    forked processes. Records that do not fit are dropped and counted.
+
+    Every ``put`` takes that lock, so all writers of a ring are serialized
+    on one cross-process lock, a syscall pair per record; keep records
+    coarse (whole encoded events) rather than writing many small pieces.
+    The segment is never unlinked implicitly, call ``close(unlink=True)``
+    once no process uses it any more.
+    """
+
+    def __init__(self, name, size=64 * 1024 * 1024):
+        self.name = name
+        try:
+            self.shm = _open(name, create=True, size=size)
+            self.shm.buf[:_HEADER.size] = bytes(_HEADER.size)
+        except FileExistsError:
+            self.shm = _open(name)
+        self.buf = self.shm.buf
+        self.capacity = len(self.buf) - _HEADER.size
+        self.lock_path = os.path.join(tempfile.gettempdir(), '%s.lock' % name)
+        self.thread_lock = threading.Lock()  # flock does not exclude threads sharing one descriptor
+        self.lock_fd = None
+        self.pid = None
+
+    def put(self, data):
+        size = _LENGTH.size + len(data)
+        with self._locked():
+            head, tail, dropped = _HEADER.unpack_from(self.buf, 0)
+            if tail - head + size > self.capacity:
+                _HEADER.pack_into(self.buf, 0, head, tail, dropped + 1)
+                return False
+            self._write(tail, _LENGTH.pack(len(data)))
+            self._write(tail + _LENGTH.size, data)
+            _HEADER.pack_into(self.buf, 0, head, tail + size, dropped)
+            return True
+
+    def get_many(self, max_count):
+        """Pop up to ``max_count`` records, returning them with the number of records dropped since the last call."""
+        records = []
+        with self._locked():
+            head, tail, dropped = _HEADER.unpack_from(self.buf, 0)
+            while head < tail and len(records) < max_count:
+                length, = _LENGTH.unpack(self._read(head, _LENGTH.size))
+                records.append(self._read(head + _LENGTH.size, length))
+                head += _LENGTH.size + length
+            _HEADER.pack_into(self.buf, 0, head, tail, 0)
+        return records, dropped
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            if not hasattr(self.shm, '_track'):  # python < 3.13 unregisters on unlink
+                from multiprocessing import resource_tracker
+                resource_tracker.register(self.shm._name, 'shared_memory')
+            self.shm.unlink()
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    def _write(self, position, data):
+        offset = _HEADER.size + position % self.capacity
+        first = min(len(data), _HEADER.size + self.capacity - offset)
+        self.buf[offset:offset + first] = data[:first]
+        if first < len(data):
+            self.buf[_HEADER.size:_HEADER.size + len(data) - first] = data[first:]
+
+    def _read(self, position, size):
+        offset = _HEADER.size + position % self.capacity
+        first = min(size, _HEADER.size + self.capacity - offset)
+        data = bytes(self.buf[offset:offset + first])
+        if first < size:
+            data += bytes(self.buf[_HEADER.size:_HEADER.size + size - first])
+        return data
+
+    def _locked(self):
+        return _FileLock(self)
+
+
+class _FileLock:
+
+    def __init__(self, ring):
+        self.ring = ring
+
+    def __enter__(self):
+        ring = self.ring
+        ring.thread_lock.acquire()
+        if ring.pid != os.getpid():
+            # a descriptor inherited through fork shares its lock with the parent
+            if ring.lock_fd is not None:
+                os.close(ring.lock_fd)
+            ring.lock_fd = os.open(ring.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            ring.pid = os.getpid()
+        fcntl.flock(ring.lock_fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.ring.lock_fd, fcntl.LOCK_UN)
+        self.ring.thread_lock.release()
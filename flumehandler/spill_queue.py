@@ -0,0 +1,208 @@
+import os
+import mmap
+import fcntl
+import struct
+import logging
+import threading
+from .thrift_encoder import to_bytes
+
+_OFFSET = struct.Struct('!Q')  # segment header: read offset of the segment
+_RECORD = struct.Struct('!II')  # record header: payload length, event count
+_EVENT = struct.Struct('!I')  # event header: encoded length
+
+
+class _Segment:
+
+    def __init__(self, path, size=None):
+        self.path = path
+        if size is not None:
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        self.file = open(path, 'r+b')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.mm = mmap.mmap(self.file.fileno(), self.size)
+        self.read_offset = _OFFSET.unpack_from(self.mm, 0)[0] or _OFFSET.size
+        self.write_offset = self._scan(self.read_offset)
+
+    def _scan(self, offset):
+        while offset + _RECORD.size <= self.size:
+            length, count = _RECORD.unpack_from(self.mm, offset)
+            if count == 0:
+                break
+            offset += _RECORD.size + length
+        return offset
+
+    def append(self, record, count):
+        if self.write_offset + _RECORD.size + len(record) > self.size:
+            return False
+        _RECORD.pack_into(self.mm, self.write_offset, len(record), count)
+        start = self.write_offset + _RECORD.size
+        self.mm[start:start + len(record)] = record
+        self.write_offset = start + len(record)
+        return True
+
+    def pop(self):
+        if self.read_offset >= self.write_offset:
+            return None
+        length, count = _RECORD.unpack_from(self.mm, self.read_offset)
+        offset = self.read_offset + _RECORD.size
+        events = []
+        for i in range(count):
+            size, = _EVENT.unpack_from(self.mm, offset)
+            offset += _EVENT.size
+            events.append(bytes(self.mm[offset:offset + size]))
+            offset += size
+        self.read_offset = offset
+        _OFFSET.pack_into(self.mm, 0, self.read_offset)
+        return events
+
+    def close(self, delete=False):
+        self.mm.close()
+        self.file.close()
+        if delete:
+            os.remove(self.path)
+
+
+def _is_segment(name):
+    return name.startswith('spill-') and name.endswith('.seg')
+
+
+def _lock_directory(directory):
+    # an exclusive flock on a lock file in the directory, raises BlockingIOError while another queue holds it
+    path = os.path.join(directory, '.lock')
+    while True:
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        except BaseException:
+            os.close(fd)
+            raise
+        os.close(fd)  # the directory was adopted and removed meanwhile, start over
+
+
+def _disk_usage(root):
+    usage = 0
+    for directory, dirs, names in os.walk(root):
+        for name in filter(_is_segment, names):
+            try:
+                usage += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass  # replayed and deleted by another process meanwhile
+    return usage
+
+
+class SpillQueue:
+    """Disk-backed FIFO of batches, kept in memory-mapped segment files.
+
+    Batches are stored as pre-encoded events, so replaying them needs no
+    conversion. When the segments would exceed ``max_bytes`` the oldest
+    segment is discarded, which makes the spill directory a bounded ring.
+    Segments left behind by a previous process are replayed as well.
+
+    A queue owns its directory exclusively through a ``flock`` on a lock file
+    in it, so creating a second queue on a directory in use, from any
+    process, raises BlockingIOError.
+
+    With ``root``, ``max_bytes`` bounds the segments of every queue below
+    ``root``; a queue only discards its own, and ``put`` returns False when
+    the others leave no room.
+    """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, max_bytes=1024 * 1024 * 1024, root=None):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.root = root
+        self.lock = threading.Lock()
+        self.lock_fd = _lock_directory(directory)
+        self.segments = []
+        for name in sorted(filter(_is_segment, os.listdir(directory))):
+            self.segments.append(_Segment(os.path.join(directory, name)))
+        self.next_seq = int(self.segments[-1].path[-16:-4]) + 1 if self.segments else 0
+
+    def put(self, events):
+        """Append a batch, returning False if there is no room for it."""
+        if not events:
+            return True
+        record = b''.join(_EVENT.pack(len(data)) + data for data in map(to_bytes, events))
+        with self.lock:
+            if not self.segments or not self.segments[-1].append(record, len(events)):
+                if not self._add_segment(max(self.segment_size, _OFFSET.size + _RECORD.size + len(record))):
+                    return False
+                self.segments[-1].append(record, len(events))
+            return True
+
+    def adopt(self, directory, remove=True):
+        """Move the segments of another queue's directory into this one, unless a queue still owns it.
+
+        Returns whether it was adopted. With ``remove`` the directory is removed afterwards.
+        """
+        try:
+            fd = _lock_directory(directory)
+        except BlockingIOError:
+            return False
+        try:
+            with self.lock:
+                for name in sorted(filter(_is_segment, os.listdir(directory))):
+                    path = os.path.join(self.directory, 'spill-%012d.seg' % self.next_seq)
+                    os.rename(os.path.join(directory, name), path)
+                    self.next_seq += 1
+                    self.segments.append(_Segment(path))
+            if remove:
+                os.remove(os.path.join(directory, '.lock'))
+                os.rmdir(directory)
+        finally:
+            os.close(fd)
+        return True
+
+    def get(self):
+        """Return the oldest spilled batch as a list of encoded events, or None if there is none."""
+        with self.lock:
+            while self.segments:
+                segment = self.segments[0]
+                events = segment.pop()
+                if events is not None:
+                    return events
+                if len(self.segments) == 1:
+                    return None
+                self.segments.pop(0).close(delete=True)
+            return None
+
+    def empty(self):
+        with self.lock:
+            return all(segment.read_offset >= segment.write_offset for segment in self.segments)
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments:
+                segment.mm.flush()
+                segment.close()
+            self.segments = []
+            if self.lock_fd is not None:
+                os.close(self.lock_fd)
+                self.lock_fd = None
+
+    def after_fork(self):
+        """Close the inherited lock file in a forked child, the parent keeps owning the directory."""
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)  # a plain close, flock is only released once the parent closes it too
+            self.lock_fd = None
+
+    def _add_segment(self, size):
+        usage = sum(segment.size for segment in self.segments) if self.root is None else _disk_usage(self.root)
+        while self.segments and usage + size > self.max_bytes:
+            segment = self.segments.pop(0)
+            logging.error('Spill queue is oversize the max bytes: %d, discarding segment %s', self.max_bytes, segment.path)
+            segment.close(delete=True)
+            usage -= segment.size
+        if usage + size > self.max_bytes and self.root is not None:
+            return False
+        path = os.path.join(self.directory, 'spill-%012d.seg' % self.next_seq)
+        self.next_seq += 1
+        self.segments.append(_Segment(path, size))
+        return True
@@ -0,0 +1,48 @@
+import threading
+import time
+from .thrift_encoder import event_size
+from .batch import Batch, NORMAL
+
+
+class StagingBuffer:
+    """Collects events until a batch reaches ``batch_size`` events or ``max_batch_bytes``.
+
+    The caller must hold ``lock`` around ``add`` and ``take``.
+    """
+
+    def __init__(self, batch_size, max_batch_bytes=None, lock=None, on_start=None, priority=NORMAL, partition=None):
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.lock = lock or threading.Lock()
+        self.on_start = on_start  # called when the first event of a batch arrives
+        self.thread = threading.current_thread()
+        self.priority = priority  # lane of the send queue the batches go to
+        self.partition = partition
+        self.events = Batch(priority=priority, partition=partition)
+        self.events_bytes = 0
+        self.started = None  # time of the first event of the current batch
+
+    def add(self, event):
+        """Append an event and return the batches that are complete."""
+        batches = []
+        if self.max_batch_bytes:
+            size = event_size(event)
+            if self.events and self.events_bytes + size > self.max_batch_bytes:
+                batches.append(self.take())
+            self.events_bytes += size
+        self.events.append(event)
+        if self.started is None:
+            self.started = time.time()
+            if self.on_start is not None:
+                self.on_start()
+        if len(self.events) >= self.batch_size or (self.max_batch_bytes and self.events_bytes >= self.max_batch_bytes):
+            batches.append(self.take())
+        return batches
+
+    def take(self):
+        events = self.events
+        events.created = time.time()
+        self.events = Batch(priority=self.priority, partition=self.partition)
+        self.events_bytes = 0
+        self.started = None
+        return events
@@ -0,0 +1,55 @@
+from thrift.transport.TSocket import TSocket
+from thrift.transport.TTransport import TFramedTransport
+from thrift.protocol.TCompactProtocol import TCompactProtocol
+from .flume_client import FlumeClient, PipelinedFlumeClient
+from . import avro_client
+
+# A transport connects to one Flume host and returns a client exposing
+# appendBatch(events) -> Status, appendBatches(batches) -> [Status] and close().
+
+
+class ThriftTransport:
+    """Framed compact Thrift, for Flume's ThriftSource; ``connect_timeout`` bounds the TCP connect in seconds."""
+
+    scatter_gather = False
+
+    def __init__(self, pipeline_window=1, connect_timeout=None):
+        self.pipeline_window = pipeline_window
+        self.connect_timeout = connect_timeout
+
+    def connect(self, host, port):
+        socket = TSocket(host, port)
+        if self.connect_timeout is not None:
+            socket.setTimeout(self.connect_timeout * 1000)
+        transport = TFramedTransport(socket)
+        protocol = TCompactProtocol(transport)
+        transport.open()
+        socket.setTimeout(None)  # sends block as before, only the connect is bounded
+        # replies are still read through the framed transport
+        sock = socket.handle if self.scatter_gather and hasattr(socket.handle, 'sendmsg') else None
+        if self.pipeline_window > 1:
+            return PipelinedFlumeClient(protocol, window=self.pipeline_window, sock=sock)
+        return FlumeClient(protocol, sock=sock)
+
+
+class ScatterGatherTransport(ThriftTransport):
+    """ThriftTransport writing each batch frame with ``socket.sendmsg``, from its encoded parts and the event bodies.
+
+    Saves joining a frame into one buffer before it is written, which pays off
+    for batches of large bodies. Falls back to ThriftTransport's writes where
+    ``sendmsg`` is not available.
+    """
+
+    scatter_gather = True
+
+
+class AvroTransport:
+    """Avro RPC, for Flume's AvroSource; ``compression_level`` enables deflate ("compression-type = deflate")."""
+
+    def __init__(self, compression_level=None, timeout=None, connect_timeout=None):
+        self.compression_level = compression_level
+        self.timeout = timeout  # seconds
+        self.connect_timeout = connect_timeout  # seconds, ``timeout`` when None
+
+    def connect(self, host, port):
+        return avro_client.connect(host, port, self.compression_level, self.timeout, self.connect_timeout)
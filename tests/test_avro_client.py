@@ -0,0 +1,71 @@
+import socket
+import struct
+import zlib
+
+import pytest
+
+from flumehandler.avro_client import AvroClient, AvroRemoteException, PROTOCOL_HASH, _encode_events
+from flumehandler.thrift_encoder import encode_event
+from flumehandler.thrift_ttypes import Status, ThriftFlumeEvent
+
+
+def test_encode_events():
+    assert _encode_events([]) == b'\x00'
+    assert _encode_events([ThriftFlumeEvent({}, b'')]) == b'\x02\x00\x00\x00'
+    assert _encode_events([ThriftFlumeEvent({'a': 'b'}, b'hi')]) == b'\x02\x02\x02a\x02b\x00\x04hi\x00'
+
+
+def test_encode_pre_encoded_events():
+    events = [ThriftFlumeEvent({'type': 'x'}, b'body'), ThriftFlumeEvent({}, b'\xff' * 70)]
+    assert _encode_events([encode_event(e.headers, e.body) for e in events]) == _encode_events(events)
+
+
+def test_read_response_with_handshake():
+    client = AvroClient(None)
+    # handshake: match BOTH, no server protocol, hash or meta; then no metadata, no error, status OK
+    assert client._read_response(b'\x00\x00\x00\x00\x00\x00\x00') == Status.OK
+    assert client.handshaked
+    assert client._read_response(b'\x00\x00\x02') == Status.FAILED
+
+
+def test_read_response_rejected_handshake():
+    client = AvroClient(None)
+    with pytest.raises(AvroRemoteException):
+        client._read_response(b'\x04\x00\x00\x00')
+    assert not client.handshaked
+
+
+def test_read_response_error():
+    client = AvroClient(None)
+    client.handshaked = True
+    with pytest.raises(AvroRemoteException, match='boom'):
+        client._read_response(b'\x00\x01\x02\x08boom')
+
+
+def _frame(serial, data):
+    return struct.pack('!iii', serial, 1, len(data)) + data
+
+
+@pytest.mark.parametrize('compression_level', [None, 0, 6])
+def test_append_batch(compression_level):
+    client_sock, server_sock = socket.socketpair()
+    client_sock.settimeout(5)
+    client = AvroClient(client_sock, compression_level)
+    compressor = zlib.compressobj()
+    response = _frame(1, b'\x00' * 7)
+    if compression_level is not None:
+        response = compressor.compress(response) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    server_sock.sendall(response)
+    try:
+        assert client.appendBatch([ThriftFlumeEvent({'a': 'b'}, b'hi')]) == Status.OK
+        request = server_sock.recv(65536)
+    finally:
+        client.close()
+        server_sock.close()
+    if compression_level is not None:
+        # level 0 still speaks deflate, only without compressing
+        request = zlib.decompressobj().decompress(request)
+    serial, count, size = struct.unpack('!iii', request[:12])
+    assert (serial, count, size) == (1, 1, len(request) - 12)
+    assert request[12:28] == PROTOCOL_HASH
+    assert request.endswith(b'\x00\x16appendBatch' + b'\x02\x02\x02a\x02b\x00\x04hi\x00')
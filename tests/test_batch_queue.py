@@ -0,0 +1,104 @@
+import random
+import threading
+import time
+from queue import Empty
+
+import pytest
+
+from flumehandler.batch import Batch, HIGH, NORMAL
+from flumehandler.batch_queue import BatchQueue
+
+
+def _batch(name, priority=NORMAL, count=1):
+    return Batch([name.encode()] * count, priority)
+
+
+def _drain(queue):
+    batches = []
+    while True:
+        try:
+            batches.append(queue.get_nowait())
+        except Empty:
+            return batches
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        BatchQueue(10, 'drop_everything')
+
+
+def test_high_lane_first_and_reserve():
+    queue = BatchQueue(4, high_reserve=0.25)
+    normal = [_batch('n%d' % i) for i in range(4)]
+    assert [queue.put(batch) for batch in normal[:3]] == [[], [], []]
+    assert queue.put(normal[3]) == [(normal[3], 'queue_full')]  # the last slot is kept for HIGH
+    high = _batch('h', HIGH)
+    assert queue.put(high) == []
+    assert _drain(queue) == [high] + normal[:3]
+
+
+def test_drop_oldest_evicts_oldest_normal_batch():
+    queue = BatchQueue(4, 'drop_oldest', high_reserve=0.25)
+    normal = [_batch('n%d' % i) for i in range(4)]
+    for batch in normal[:3]:
+        queue.put(batch)
+    assert queue.put(normal[3]) == [(normal[0], 'queue_full')]
+    high = _batch('h', HIGH)
+    assert queue.put(high) == []
+    newer = _batch('n4')
+    # four queued against a NORMAL limit of three: two NORMAL batches make room, the HIGH one stays
+    assert queue.put(newer) == [(normal[1], 'queue_full'), (normal[2], 'queue_full')]
+    assert _drain(queue) == [high, normal[3], newer]
+
+
+def test_drop_oldest_never_evicts_high_for_normal():
+    queue = BatchQueue(2, 'drop_oldest', high_reserve=0.5)
+    high = [_batch('h%d' % i, HIGH) for i in range(3)]
+    queue.put(high[0])
+    queue.put(high[1])
+    normal = _batch('n')
+    assert queue.put(normal) == [(normal, 'queue_full')]
+    assert queue.put(high[2]) == [(high[0], 'queue_full')]  # HIGH evicts HIGH once no NORMAL is left
+    assert _drain(queue) == high[1:]
+
+
+def test_block_waits_for_room_then_discards():
+    queue = BatchQueue(1, 'block', block_timeout=0.1, high_reserve=0)
+    first, second = _batch('a'), _batch('b')
+    queue.put(first)
+    start = time.time()
+    assert queue.put(second) == [(second, 'queue_full')]
+    assert time.time() - start >= 0.09
+    threading.Timer(0.05, queue.get).start()
+    assert queue.put(second, timeout=2) == []
+    assert _drain(queue) == [second]
+
+
+def test_sample_keeps_a_share_under_pressure():
+    random.seed(1)
+    queue = BatchQueue(10, 'sample', high_reserve=0, sample_threshold=0.5)
+    for i in range(9):
+        assert queue.put(_batch('h%d' % i, HIGH)) == []  # HIGH batches count towards the pressure, unsampled
+    batch = _batch('big', count=1000)
+    discarded = queue.put(batch)
+    assert [reason for dropped, reason in discarded] == ['sampled']
+    # pressure 0.9 against a threshold of 0.5 keeps (1 - 0.9) / (1 - 0.5) of the events
+    assert 100 < len(batch) < 300
+    assert len(batch) + len(discarded[0][0]) == 1000
+
+
+def test_byte_accounting():
+    queue = BatchQueue(10, max_bytes=100, high_reserve=0.1)
+    high = Batch([b'x' * 30], HIGH)
+    normal = Batch([b'y' * 20, b'z' * 20])
+    queue.put(normal)
+    queue.put(high)
+    assert queue.bytes == 70
+    too_big = Batch([b'w' * 25])
+    assert queue.put(too_big) == [(too_big, 'queue_full')]  # 95 bytes is over the NORMAL share of 90
+    assert queue.get() is high
+    assert queue.bytes == 40
+    assert queue.put(too_big) == []
+    assert queue.bytes == 65
+    _drain(queue)
+    assert queue.bytes == 0
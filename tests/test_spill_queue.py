@@ -0,0 +1,73 @@
+import os
+import struct
+
+import pytest
+
+from flumehandler.spill_queue import SpillQueue
+
+
+def _segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.seg'))
+
+
+def test_segment_format(tmp_path):
+    queue = SpillQueue(str(tmp_path), segment_size=4096)
+    queue.put([b'ab', b'c'])
+    queue.close()
+    with open(os.path.join(str(tmp_path), 'spill-000000000000.seg'), 'rb') as f:
+        data = f.read()
+    assert len(data) == 4096
+    # read offset, then records of payload length and event count followed by length-prefixed events
+    assert data[:27] == struct.pack('!Q', 0) + struct.pack('!II', 11, 2) + b'\x00\x00\x00\x02ab\x00\x00\x00\x01c'
+    assert data[27:] == bytes(4096 - 27)
+
+
+def test_replay_after_reopening(tmp_path):
+    queue = SpillQueue(str(tmp_path), segment_size=64)
+    for i in range(10):
+        queue.put([b'event %d' % i, b'x' * i])
+    assert queue.get() == [b'event 0', b'']
+    queue.close()
+    assert len(_segments(str(tmp_path))) > 1
+    queue = SpillQueue(str(tmp_path), segment_size=64)
+    assert [queue.get() for i in range(9)] == [[b'event %d' % i, b'x' * i] for i in range(1, 10)]
+    assert queue.get() is None
+    assert queue.empty()
+    queue.put([b'after'])  # appended after the replayed segments, not over them
+    queue.close()
+    queue = SpillQueue(str(tmp_path), segment_size=64)
+    assert queue.get() == [b'after']
+    queue.close()
+
+
+def test_directory_is_owned_by_one_queue(tmp_path):
+    queue = SpillQueue(str(tmp_path))
+    with pytest.raises(BlockingIOError):
+        SpillQueue(str(tmp_path))
+    queue.close()
+    SpillQueue(str(tmp_path)).close()
+
+
+def test_adopt(tmp_path):
+    root = str(tmp_path)
+    other = os.path.join(root, 'pid-1')
+    queue = SpillQueue(root)
+    orphan = SpillQueue(other)
+    orphan.put([b'orphaned'])
+    assert not queue.adopt(other)  # still owned
+    orphan.close()
+    queue.put([b'own'])
+    assert queue.adopt(other)
+    assert not os.path.exists(other)
+    assert [queue.get(), queue.get(), queue.get()] == [[b'own'], [b'orphaned'], None]
+    queue.close()
+
+
+def test_max_bytes_under_root(tmp_path):
+    root = str(tmp_path)
+    a = SpillQueue(root, segment_size=4096, max_bytes=8192, root=root)
+    b = SpillQueue(os.path.join(root, 'pid-1'), segment_size=4096, max_bytes=8192, root=root)
+    assert a.put([b'x' * 3000]) and a.put([b'x' * 3000])
+    assert not b.put([b'y' * 3000])  # only a's segments could make room, and b does not discard them
+    a.close()
+    b.close()
@@ -0,0 +1,57 @@
+import pytest
+from thrift.protocol.TCompactProtocol import TCompactProtocol
+from thrift.transport.TTransport import TMemoryBuffer
+
+from flumehandler.thrift_encoder import batch_segments, decode_event, encode_batch, encode_event, encode_headers, \
+    to_bytes
+from flumehandler.thrift_protocol import Client
+from flumehandler.thrift_ttypes import ThriftFlumeEvent
+
+
+def _generated(events, seqid=0):
+    buffer = TMemoryBuffer()
+    client = Client(TCompactProtocol(TMemoryBuffer()), TCompactProtocol(buffer))
+    client._seqid = seqid
+    client.send_appendBatch(events)
+    return buffer.getvalue()
+
+
+def _events(count):
+    events = []
+    for i in range(count):
+        headers = {} if i % 3 == 0 else {'type': 'access', 'n': str(i), 'unicode': 'é中'}
+        events.append(ThriftFlumeEvent(headers=headers, body=b'x' * (i * 37 % 200) + b'\xff'))
+    return events
+
+
+@pytest.mark.parametrize('count', [0, 1, 14, 15, 16, 300])
+@pytest.mark.parametrize('seqid', [0, 1, 127, 128, 2 ** 31 - 1])
+def test_encode_batch_matches_generated_code(count, seqid):
+    events = _events(count)
+    expected = _generated(events, seqid)
+    assert encode_batch(events, seqid) == expected
+    assert encode_batch([encode_event(e.headers, e.body) for e in events], seqid) == expected
+    assert b''.join(batch_segments(events, seqid)) == expected
+
+
+def test_batch_segments_reference_large_bodies():
+    body = b'y' * 5000
+    events = [ThriftFlumeEvent(headers={'a': 'b'}, body=body)]
+    segments = batch_segments(events)
+    assert any(segment is body for segment in segments)
+    assert b''.join(segments) == _generated(events)
+
+
+def test_encode_event_with_pre_encoded_headers():
+    static = {'type': 'access', 'host': 'h1'}
+    encoded = encode_event({'dynamic': 'd'}, 'body', encode_headers(static), len(static))
+    event = decode_event(encoded)
+    assert event.headers == {'type': 'access', 'host': 'h1', 'dynamic': 'd'}
+    assert event.body == b'body'
+
+
+def test_missing_headers_are_an_empty_map():
+    # the generated code skips a None field, flume's IDL requires headers, so an empty map is written instead
+    event = ThriftFlumeEvent(headers=None, body=b'b')
+    assert encode_batch([event]) == _generated([ThriftFlumeEvent(headers={}, body=b'b')])
+    assert decode_event(to_bytes(event)).headers == {}